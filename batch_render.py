@@ -0,0 +1,148 @@
+import cv2
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from main import MaskOutput, build_masks, load_shapes_file
+
+# Минимальная длина фрагмента: короче - накладные расходы на поиск ключевого кадра
+# и запуск записи съедают выигрыш от параллельности
+MIN_CHUNK_FRAMES = 48
+
+
+def _init_worker():
+    # Параллелим по процессам, внутренние потоки OpenCV только мешают друг другу
+    cv2.setNumThreads(1)
+
+
+def split_ranges(total_frames, workers):
+    """Делит видео на непрерывные диапазоны кадров [start, end)."""
+    chunks = max(1, min(workers * 4, total_frames // MIN_CHUNK_FRAMES))
+    step = -(-total_frames // chunks)
+    return [(start, min(start + step, total_frames)) for start in range(0, total_frames, step)]
+
+
+def _seek_exact(cap, start):
+    """
+    Ставит видео на кадр start. Если контейнер не перематывает точно
+    (позиция после перемотки другая), кадры до start читаются подряд.
+    """
+    if not start:
+        return
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == start:
+        return
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    for index in range(start):
+        if not cap.grab():
+            raise RuntimeError(f"Видео закончилось на кадре {index}, не дойдя до {start}")
+
+
+def render_range(video_path, shapes_data, start, end, segment_path, fourcc, last=False):
+    """
+    Рендерит кадры [start, end) с масками в отдельный файл-фрагмент.
+
+    Фрагмент короче диапазона - ошибка: склейка сдвинула бы маски
+    относительно видео. Только последний (last) может закончиться раньше,
+    если число кадров в заголовке контейнера завышено.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Не удалось открыть видео файл {video_path}")
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+    # Та же растеризация и тот же кэш анимированных масок, что и у выхода плеера
+    output = MaskOutput('render', None)
+    output.masks = build_masks(shapes_data, width, height, fps=fps)
+    output.time_quantum = 1.0 / fps
+    writer = cv2.VideoWriter(segment_path, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+
+    _seek_exact(cap, start)
+    written = 0
+    frame = None
+    for index in range(start, end):
+        ret, frame = cap.read(frame)
+        if not ret:
+            break
+        compiled = output.compiled(width, height, index / fps)
+        writer.write(compiled.apply(frame, out=frame))
+        written += 1
+
+    writer.release()
+    cap.release()
+    if written != end - start and not last:
+        raise RuntimeError(f"Фрагмент {start}..{end}: прочитано {written} кадров из {end - start}")
+    return written
+
+
+def concat_segments(segment_paths, output_path, fourcc, fps, size):
+    """Склеивает фрагменты по порядку: через ffmpeg без перекодирования, если он есть."""
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg:
+        list_path = os.path.join(os.path.dirname(segment_paths[0]), 'segments.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for path in segment_paths:
+                f.write(f"file '{path}'\n")
+        result = subprocess.run(
+            [ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+             '-i', list_path, '-c', 'copy', output_path])
+        if result.returncode == 0:
+            return
+        print("ffmpeg не смог склеить фрагменты, склеиваем через OpenCV")
+
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    for path in segment_paths:
+        cap = cv2.VideoCapture(path)
+        frame = None
+        while True:
+            ret, frame = cap.read(frame)
+            if not ret:
+                break
+            writer.write(frame)
+        cap.release()
+    writer.release()
+
+
+def render_video(video_path, masks_path, output_path, workers=None, fourcc='mp4v'):
+    """Запекает маски из masks_path в видео без открытия окон."""
+    shapes_data = load_shapes_file(masks_path)
+    if not build_masks(shapes_data, 1, 1):
+        # Плеер без масок показывает кадр как есть, здесь вышло бы чёрное видео
+        print(f"Ошибка: в {masks_path} нет замкнутых фигур, накладывать нечего")
+        return False
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Ошибка: Не удалось открыть видео файл {video_path}")
+        return False
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.release()
+    if total_frames <= 0:
+        print("Ошибка: Не удалось определить число кадров в видео")
+        return False
+
+    workers = workers or os.cpu_count() or 1
+    ranges = split_ranges(total_frames, workers)
+    extension = os.path.splitext(output_path)[1] or '.mp4'
+    print(f"Рендер {total_frames} кадров {width}x{height}: "
+          f"{len(ranges)} фрагментов, процессов: {workers}")
+
+    with tempfile.TemporaryDirectory(prefix='tro_render_') as tmp_dir:
+        segment_paths = [os.path.join(tmp_dir, f"segment_{i:05d}{extension}")
+                         for i in range(len(ranges))]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = [pool.submit(render_range, video_path, shapes_data, start, end, path, fourcc,
+                                   last=(start, end) == ranges[-1])
+                       for (start, end), path in zip(ranges, segment_paths)]
+            written = sum(future.result() for future in futures)
+        concat_segments(segment_paths, output_path, fourcc, fps, (width, height))
+
+    print(f"Готово: {written} кадров записано в {output_path}")
+    return True
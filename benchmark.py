@@ -0,0 +1,260 @@
+"""
+Бенчмарки горячих путей плеера и редактора без дисплея и проектора.
+
+Кадры синтетические, Qt работает на платформе offscreen. Результаты
+сохраняются в JSON, два таких файла можно сравнить через --compare:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import cv2
+import numpy as np
+from PyQt6.QtGui import QPixmap
+from PyQt6.QtWidgets import QApplication
+
+import mask_protocol
+from compositor import StripedCompositor
+from main import VideoMaskPlayer
+from shape_editor import CanvasWidget, Shape
+
+RESOLUTIONS = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '4K': (3840, 2160),
+    '8K': (7680, 4320),
+}
+SHAPE_COUNTS = [1, 16, 128]
+VERTEX_COUNTS = [8, 256, 4096]
+
+QUICK_RESOLUTIONS = ['720p', '4K']
+QUICK_SHAPE_COUNTS = [1, 16]
+QUICK_VERTEX_COUNTS = [8, 256]
+
+CANVAS_SIZE = (1280, 720)
+
+
+def make_shapes(shape_count, vertex_count, seed=0):
+    """Звёздчатые многоугольники в нормализованных координатах, разбросанные по кадру"""
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, vertex_count, endpoint=False)
+    radii = np.where(np.arange(vertex_count) % 2, 0.5, 1.0)
+    unit = np.stack([np.cos(angles) * radii, np.sin(angles) * radii], axis=1)
+    shapes = []
+    for i in range(shape_count):
+        center = rng.uniform(0.15, 0.85, size=2)
+        size = rng.uniform(0.03, 0.15)
+        points = np.clip(center + unit * size, 0.0, 1.0).astype(np.float32)
+        shapes.append({'id': i, 'points': points, 'is_closed': True})
+    return shapes
+
+
+def measure(fn, repeat, warmup=1):
+    """Время вызова fn в миллисекундах: среднее, медиана и минимум по repeat запускам"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return {
+        'mean_ms': statistics.fmean(samples),
+        'median_ms': statistics.median(samples),
+        'min_ms': min(samples),
+        'repeat': repeat,
+    }
+
+
+def _quiet(fn):
+    """Глушит print внутри измеряемых функций плеера"""
+    def wrapper():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return wrapper
+
+
+def bench_player(resolutions, shape_counts, vertex_counts, repeat, threads):
+    results = []
+    striped = StripedCompositor(threads) if threads > 1 else None
+    for name in resolutions:
+        width, height = RESOLUTIONS[name]
+        frame = np.random.default_rng(1).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        out = np.empty_like(frame)
+        for shape_count in shape_counts:
+            for vertex_count in vertex_counts:
+                shapes = make_shapes(shape_count, vertex_count)
+                params = {'resolution': name, 'shapes': shape_count, 'vertices': vertex_count}
+
+                player = VideoMaskPlayer()
+                player.width, player.height = width, height
+                set_masks = _quiet(lambda: player.set_mask_from_editor(shapes))
+                results.append({'name': 'set_mask_from_editor', 'params': params,
+                                **measure(set_masks, repeat)})
+                results.append({'name': 'apply_all_masks', 'params': params,
+                                **measure(lambda: player.apply_all_masks(frame, out=out), repeat)})
+                if striped is not None:
+                    output = player.outputs[mask_protocol.DEFAULT_OUTPUT]
+                    output.striped = striped
+                    striped_params = {**params, 'threads': threads}
+                    results.append({'name': 'set_mask_from_editor_striped', 'params': striped_params,
+                                    **measure(set_masks, repeat)})
+                    results.append({'name': 'apply_all_masks_striped', 'params': striped_params,
+                                    **measure(lambda: player.apply_all_masks(frame, out=out), repeat)})
+                print(f"  player {name} shapes={shape_count} vertices={vertex_count}")
+    if striped is not None:
+        striped.close()
+    return results
+
+
+def bench_protocol(shape_counts, vertex_counts, repeat):
+    """Разбор нагрузки, которую принимает control_server.ControlServer: бинарный формат и старый JSON"""
+    results = []
+    for shape_count in shape_counts:
+        for vertex_count in vertex_counts:
+            shapes = make_shapes(shape_count, vertex_count)
+            params = {'shapes': shape_count, 'vertices': vertex_count}
+
+            message = mask_protocol.encode_set(shapes)
+            header = mask_protocol.HEADER.size
+            msg_type = mask_protocol.MSG_SET
+            payload = bytearray(message[header:])
+            results.append({'name': 'decode_binary', 'params': params,
+                            **measure(lambda: mask_protocol.decode_message(msg_type, payload), repeat)})
+
+            legacy = json.dumps([{'points': s['points'].tolist(), 'is_closed': True}
+                                 for s in shapes]).encode('utf-8')
+            results.append({'name': 'decode_json', 'params': params,
+                            **measure(lambda: json.loads(legacy.decode('utf-8')), repeat)})
+    return results
+
+
+def make_canvas(shapes):
+    canvas = CanvasWidget()
+    canvas.preview_timer.stop()
+    canvas.resize(*CANVAS_SIZE)
+    for shape_data in shapes:
+        shape = Shape()
+        shape.set_points(shape_data['points'])
+        shape.close()
+        canvas.shapes.append(shape)
+        canvas.index.add_shape(shape)
+    return canvas
+
+
+def bench_editor(shape_counts, vertex_counts, repeat):
+    results = []
+    pixmap = QPixmap(*CANVAS_SIZE)
+    for shape_count in shape_counts:
+        for vertex_count in vertex_counts:
+            canvas = make_canvas(make_shapes(shape_count, vertex_count))
+            params = {'shapes': shape_count, 'vertices': vertex_count,
+                      'canvas': f"{CANVAS_SIZE[0]}x{CANVAS_SIZE[1]}"}
+            shape = canvas.shapes[0]
+
+            results.append({'name': 'Shape.to_dict', 'params': params,
+                            **measure(shape.to_dict, repeat)})
+            results.append({'name': 'CanvasWidget.shape_to_dict', 'params': params,
+                            **measure(lambda: [canvas.shape_to_dict(s) for s in canvas.shapes], repeat)})
+
+            def paint_cold():
+                canvas._layer = None
+                canvas.render(pixmap)
+
+            results.append({'name': 'paintEvent_cold', 'params': params,
+                            **measure(paint_cold, repeat)})
+            results.append({'name': 'paintEvent_cached', 'params': params,
+                            **measure(lambda: canvas.render(pixmap), repeat)})
+            canvas.deleteLater()
+            print(f"  editor shapes={shape_count} vertices={vertex_count}")
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def _key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, baseline_path):
+    """Печатает отношение медиан к сохранённому ранее прогону"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {_key(r): r for r in json.load(f)['results']}
+    print(f"\nСравнение с {baseline_path} (медиана, >1 - медленнее):")
+    for result in results:
+        old = baseline.get(_key(result))
+        if old is None or old['median_ms'] == 0:
+            continue
+        ratio = result['median_ms'] / old['median_ms']
+        flag = '  <-- регрессия' if ratio > 1.1 else ''
+        print(f"  {result['name']:28} {json.dumps(result['params'], sort_keys=True):70} "
+              f"{old['median_ms']:9.3f} -> {result['median_ms']:9.3f} ms  x{ratio:.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки маскирования и сериализации")
+    parser.add_argument('--output', default='benchmark_results.json', help="Куда сохранить JSON")
+    parser.add_argument('--compare', metavar='JSON', help="Сравнить с результатами прошлого прогона")
+    parser.add_argument('--quick', action='store_true', help="Сокращённая сетка параметров")
+    parser.add_argument('--repeat', type=int, default=10, help="Число замеров на точку")
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1,
+                        help="Потоков для замеров наложения полосами (1 - не замерять)")
+    parser.add_argument('--only', choices=['player', 'protocol', 'editor'], action='append',
+                        help="Запустить только указанные группы")
+    args = parser.parse_args(argv)
+
+    resolutions = QUICK_RESOLUTIONS if args.quick else list(RESOLUTIONS)
+    shape_counts = QUICK_SHAPE_COUNTS if args.quick else SHAPE_COUNTS
+    vertex_counts = QUICK_VERTEX_COUNTS if args.quick else VERTEX_COUNTS
+    groups = args.only or ['player', 'protocol', 'editor']
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    results = []
+    if 'player' in groups:
+        print("Плеер:")
+        results += bench_player(resolutions, shape_counts, vertex_counts, args.repeat, args.threads)
+    if 'protocol' in groups:
+        print("Протокол:")
+        results += bench_protocol(shape_counts, vertex_counts, args.repeat)
+    if 'editor' in groups:
+        print("Редактор:")
+        results += bench_editor(shape_counts, vertex_counts, args.repeat)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Наложение масок горизонтальными полосами на нескольких потоках.
+
+cv2.bitwise_and и cv2.fillPoly отпускают GIL, поэтому полосы одного
+кадра обрабатываются потоками постоянного пула параллельно, без
+процессов и копирования кадра. Полосы не пересекаются и пишут прямо в
+уже выделенный буфер результата. Заливка полигонов при компиляции
+маски распределяется по потокам не полосами, а по полигонам.
+
+Маленькие кадры обрабатываются одним вызовом: раздача полос потокам
+обходится дороже самой работы.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Кадры меньше этой площади (половина 4K) обрабатываются одним потоком
+MIN_PIXELS = 3840 * 1080
+# Полосы тоньше этого числа строк не дают выигрыша
+MIN_STRIPE_ROWS = 32
+
+
+class StripedCompositor:
+    """Постоянный пул потоков, обрабатывающий кадр полосами строк"""
+
+    def __init__(self, workers=None, min_pixels=MIN_PIXELS):
+        self.workers = workers or os.cpu_count() or 1
+        self.min_pixels = min_pixels
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='compositor')
+        self._stripes = {}  # число строк -> границы полос
+
+    def enabled_for(self, height, width):
+        """Стоит ли делить кадр такого размера на полосы"""
+        return self.workers > 1 and height * width >= self.min_pixels
+
+    def stripes(self, rows):
+        """Границы полос [(начало, конец)] для кадра из rows строк (кэшируются)"""
+        stripes = self._stripes.get(rows)
+        if stripes is None:
+            count = max(1, min(self.workers, rows // MIN_STRIPE_ROWS))
+            step = -(-rows // count)
+            stripes = self._stripes[rows] = [(start, min(start + step, rows))
+                                             for start in range(0, rows, step)]
+        return stripes
+
+    def run(self, fn, rows):
+        """Вызывает fn(начало, конец) для каждой полосы и ждёт все полосы"""
+        stripes = self.stripes(rows)
+        # Последнюю полосу считает вызывающий поток, пока пул занят остальными
+        futures = [self._pool.submit(fn, start, end) for start, end in stripes[:-1]]
+        fn(*stripes[-1])
+        for future in futures:
+            future.result()
+
+    def fill(self, raster, polygons, value=255):
+        """
+        Заливает полигоны в raster параллельно.
+
+        Делить заливку на полосы нельзя: fillPoly по-разному округляет рёбра,
+        обрезанные краем изображения, и результат отличается от заливки
+        целиком. Поэтому каждый поток заливает свои полигоны в отдельные
+        буферы размером с их ограничивающий прямоугольник (сдвиг на целое
+        число пикселей, обрезка - только по краям кадра, как и без потоков),
+        а объединение с raster делается в вызывающем потоке.
+        """
+        height, width = raster.shape[:2]
+
+        def fill_one(points):
+            x, y, w, h = cv2.boundingRect(points)
+            x0, y0 = max(x, 0), max(y, 0)
+            x1, y1 = min(x + w, width), min(y + h, height)
+            if x1 <= x0 or y1 <= y0:
+                return None
+            scratch = np.zeros((y1 - y0, x1 - x0), dtype=raster.dtype)
+            cv2.fillPoly(scratch, [points], value, offset=(-x0, -y0))
+            return x0, y0, x1, y1, scratch
+
+        for result in self._pool.map(fill_one, polygons):
+            if result is not None:
+                x0, y0, x1, y1, scratch = result
+                region = raster[y0:y1, x0:x1]
+                cv2.bitwise_or(region, scratch, dst=region)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,149 @@
+"""
+Сервер управления плеером на asyncio.
+
+Один фоновый поток с циклом событий обслуживает сколько угодно клиентов
+одновременно: редакторы (обновления масок), скрипты автоматизации
+(команды и запросы состояния) и старых клиентов с одним JSON на
+соединение. Медленный или зависший клиент задерживает только свою
+сопрограмму.
+
+С плеером сервер связан только неблокирующими вызовами: маски уходят в
+mask_queue, команды - в очередь, которую цикл показа разбирает между
+кадрами (VideoMaskPlayer.submit_control), а запрос состояния читает уже
+готовые поля плеера (VideoMaskPlayer.status). Ответы пишутся в буфер
+соединения без ожидания отправки: клиент, который их не читает, будет
+отключён, когда его буфер превысит MAX_PENDING_REPLY байт, но ни сервер,
+ни показ кадров его не ждут.
+"""
+import asyncio
+import json
+import threading
+
+import mask_protocol
+
+MAX_PENDING_REPLY = 1024 * 1024
+
+
+class ControlServer:
+    """Цикл asyncio в фоновом потоке, принимающий клиентов плеера"""
+
+    def __init__(self, player, host=mask_protocol.HOST, port=mask_protocol.PORT):
+        self.player = player
+        self.host = host
+        self.port = port
+        self._loop = None
+        self._stop = None
+        self._thread = None
+        self._clients = {}  # задача клиента -> его StreamWriter
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='control-server', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._serve())
+        except OSError as e:
+            print(f"Сервер управления не запущен: {e}")
+        finally:
+            self._loop.close()
+
+    async def _serve(self):
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        print(f"Сервер слушает на {self.host}:{self.port}")
+        await self._stop.wait()
+        server.close()
+        # Соединения клиентов живут дольше сервера: рвём их, и сопрограммы клиентов
+        # завершаются сами, как при обрыве связи
+        for writer in self._clients.values():
+            writer.transport.abort()
+        if self._clients:
+            await asyncio.wait(list(self._clients), timeout=1.0)
+
+    def close(self):
+        loop = self._loop
+        if loop is not None and self._stop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._stop.set)
+            self._thread.join(timeout=2.0)
+
+    async def _handle_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        print(f"Подключился {addr}")
+        task = asyncio.current_task()
+        self._clients[task] = writer
+        try:
+            try:
+                header = await reader.readexactly(mask_protocol.HEADER.size)
+            except asyncio.IncompleteReadError as e:
+                header = e.partial  # Короткий JSON старого формата
+            if not header:
+                return
+            if not header.startswith(mask_protocol.MAGIC):
+                self._read_legacy_json(header + await reader.read())
+                return
+            if len(header) < mask_protocol.HEADER.size:
+                return
+            target = mask_protocol.DEFAULT_OUTPUT  # Выход выбирается сообщением MSG_TARGET
+            while True:
+                msg_type, length = mask_protocol.parse_header(header)
+                payload = await reader.readexactly(length)
+                kind, data = mask_protocol.decode_message(msg_type, payload)
+                if kind == 'target':
+                    target = data
+                elif kind == 'skip':
+                    self.player.request_skip(data)
+                elif kind == 'command':
+                    if not self._reply(writer, self._command(data)):
+                        print(f"Клиент {addr} не читает ответы, соединение разорвано")
+                        # close() ждал бы отправки буфера, который клиент не читает
+                        writer.transport.abort()
+                        return
+                elif kind == 'reply':
+                    raise mask_protocol.ProtocolError("Ответ от клиента")
+                else:
+                    self.player.mask_queue.put((target, kind, data))
+                header = await reader.readexactly(mask_protocol.HEADER.size)
+        except asyncio.IncompleteReadError:
+            pass  # Клиент закрыл соединение
+        except mask_protocol.ProtocolError as e:
+            print(f"Ошибка протокола от {addr}: {e}")
+        except OSError as e:
+            print(f"Соединение с {addr} прервано: {e}")
+        finally:
+            del self._clients[task]
+            writer.close()
+
+    def _command(self, request):
+        """Выполняет команду или запрос клиента, возвращает ответ"""
+        reply = {'id': request.get('id'), 'ok': True}
+        try:
+            if request.get('cmd') == 'ping':
+                pass  # Подтверждение, что предыдущие сообщения соединения приняты
+            elif request.get('cmd') == 'status':
+                reply['status'] = self.player.status()
+            else:
+                error = self.player.submit_control(request)
+                if error:
+                    reply.update(ok=False, error=error)
+        except (TypeError, ValueError) as e:
+            reply.update(ok=False, error=f"некорректные параметры: {e}")
+        return reply
+
+    @staticmethod
+    def _reply(writer, reply):
+        """Ставит ответ в буфер соединения. False - клиент слишком отстал."""
+        if writer.transport.get_write_buffer_size() > MAX_PENDING_REPLY:
+            return False
+        writer.write(mask_protocol.encode_reply(reply))
+        return True
+
+    def _read_legacy_json(self, data):
+        """Старый формат: один JSON со списком фигур до закрытия соединения."""
+        try:
+            shapes_data = json.loads(data.decode('utf-8'))
+            self.player.mask_queue.put((mask_protocol.DEFAULT_OUTPUT, 'set', shapes_data))
+            print(f"Получены новые маски от клиента ({len(shapes_data)} шт.)")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print("Ошибка: получены некорректные JSON данные")
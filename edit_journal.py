@@ -0,0 +1,233 @@
+"""
+Журнал правок редактора масок: отмена/повтор и восстановление после сбоя.
+
+Каждая правка - компактная команда (JSON в одну строку), которая
+дописывается в конец файла журнала; весь документ при этом не
+перезаписывается. Раз в SNAPSHOT_EVERY записей документ вместе со стеками
+отмены и повтора сохраняется снимком, и журнал начинается заново. При
+запуске редактор читает снимок и проигрывает поверх него записи журнала.
+
+Команда - словарь с ключом 'op' и данными, которых хватает и чтобы её
+выполнить, и чтобы откатить. Что означает каждая команда, решает
+вызывающий код (см. CanvasWidget.apply_command), журнал только хранит их
+и ведёт стеки.
+
+Одним файлом журнала пользуется один редактор: он держит блокировку на
+файле рядом с журналом (lock). Второй редактор с тем же путём берёт
+первый свободный из запасных журналов path.1 .. path.N и восстанавливается
+из него так же, как из основного (open_exclusive).
+"""
+import json
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+SNAPSHOT_EVERY = 200
+# Глубина отмены: старые команды отбрасываются, иначе снимок (и его запись
+# с fsync) рос бы всю сессию - команды 'replace' хранят документ целиком
+MAX_UNDO = 100
+EXTRA_SLOTS = 3  # Запасных журналов для одновременно открытых редакторов
+SNAPSHOT_VERSION = 1
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.tro', 'editor.journal')
+
+
+class EditJournal:
+    """Файл журнала команд, его снимок и стеки отмены/повтора"""
+
+    def __init__(self, path=DEFAULT_PATH, snapshot_every=SNAPSHOT_EVERY, max_undo=MAX_UNDO):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.max_undo = max_undo
+        self.undo_stack = []
+        self.redo_stack = []
+        self.seq = 0  # Номер последней записи журнала
+        self._snapshot_seq = 0  # Номер последней записи, вошедшей в снимок
+        self._file = None  # None - журнал не пишется на диск, отмена работает только в памяти
+        self._lock_file = None
+
+    @property
+    def snapshot_path(self):
+        return self.path + '.snapshot'
+
+    @property
+    def lock_path(self):
+        return self.path + '.lock'
+
+    @property
+    def is_open(self):
+        return self._file is not None
+
+    @property
+    def needs_snapshot(self):
+        return self._file is not None and self.seq - self._snapshot_seq >= self.snapshot_every
+
+    def lock(self):
+        """
+        Берёт блокировку журнала до close. False - журнал открыт другим
+        процессом. Блокировка снимается и при падении процесса.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        lock_file = open(self.lock_path, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def recover(self, load, apply):
+        """
+        Восстанавливает состояние прошлого запуска.
+
+        load(документ) получает документ из снимка, apply(команда, вперёд)
+        затем выполняет (вперёд=True) или откатывает записи журнала после
+        снимка. Возвращает число проигранных записей. После восстановления
+        нужно вызвать compact: он начинает журнал заново.
+        """
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('version') != SNAPSHOT_VERSION:
+                raise ValueError(f"неподдерживаемая версия {state.get('version')}")
+        except FileNotFoundError:
+            state = None
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Журнал правок: снимок {self.snapshot_path} не прочитан: {e}")
+            # Без снимка записи журнала проигрывать не на что
+            return 0
+        if state is not None:
+            load(state['document'])
+            self.undo_stack = state['undo']
+            self.redo_stack = state['redo']
+            self.seq = self._snapshot_seq = state['n']
+
+        replayed = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Недописанная последняя строка - сбой пришёлся на запись
+                    n = entry.get('n', 0)
+                    if n <= self.seq:
+                        continue  # Уже в снимке: сбой между снимком и очисткой журнала
+                    if n != self.seq + 1:
+                        print(f"Журнал правок: пропуск записей {self.seq + 1}..{n - 1}, остальное не проигрывается")
+                        break
+                    self.seq = n
+                    if 'do' in entry:
+                        self._push_undo(entry['do'])
+                        self.redo_stack.clear()
+                        apply(entry['do'], True)
+                    elif entry.get('undo') and self.undo_stack:
+                        command = self.undo_stack.pop()
+                        self.redo_stack.append(command)
+                        apply(command, False)
+                    elif entry.get('redo') and self.redo_stack:
+                        command = self.redo_stack.pop()
+                        self._push_undo(command)
+                        apply(command, True)
+                    replayed += 1
+        except FileNotFoundError:
+            pass
+        return replayed
+
+    def _push_undo(self, command):
+        self.undo_stack.append(command)
+        if len(self.undo_stack) > self.max_undo:
+            del self.undo_stack[:len(self.undo_stack) - self.max_undo]
+
+    def record(self, command):
+        """Записывает выполненную команду. Стек повтора сбрасывается."""
+        self._push_undo(command)
+        self.redo_stack.clear()
+        self._write({'do': command})
+
+    def undo(self):
+        """Команда, которую нужно откатить, или None"""
+        if not self.undo_stack:
+            return None
+        command = self.undo_stack.pop()
+        self.redo_stack.append(command)
+        self._write({'undo': True})
+        return command
+
+    def redo(self):
+        """Команда, которую нужно выполнить снова, или None"""
+        if not self.redo_stack:
+            return None
+        command = self.redo_stack.pop()
+        self._push_undo(command)
+        self._write({'redo': True})
+        return command
+
+    def _write(self, entry):
+        self.seq += 1
+        if self._file is None:
+            return
+        entry['n'] = self.seq
+        self._file.write(json.dumps(entry, separators=(',', ':'), ensure_ascii=False) + '\n')
+        # Буфер процесса сбрасываем сразу: запись переживает падение редактора
+        self._file.flush()
+
+    def compact(self, document):
+        """
+        Сохраняет снимок документа и стеков атомарно и начинает журнал заново.
+
+        Ошибки записи (OSError) пробрасываются, журнал при этом отключается.
+        """
+        # Стеки уже ограничены max_undo, но снимок прошлой версии мог хранить больше
+        state = {'version': SNAPSHOT_VERSION, 'n': self.seq, 'document': document,
+                 'undo': self.undo_stack[-self.max_undo:], 'redo': self.redo_stack[-self.max_undo:]}
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, separators=(',', ':'), ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            self._snapshot_seq = self.seq
+            # Записи до снимка больше не нужны
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.path, 'w', encoding='utf-8')
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._lock_file is not None:
+            self._lock_file.close()  # Закрытие файла снимает блокировку
+            self._lock_file = None
+
+
+def open_exclusive(path=DEFAULT_PATH, snapshot_every=SNAPSHOT_EVERY):
+    """
+    Журнал по пути path с блокировкой. Если его уже держит другой
+    редактор - первый свободный запасной журнал path.1 .. path.EXTRA_SLOTS,
+    чтобы два редактора не писали записи в один файл вперемешку. Номера
+    постоянные, поэтому после сбоя запасной журнал восстановит следующий
+    редактор, которому он достанется. None - заняты все.
+    """
+    for slot in range(EXTRA_SLOTS + 1):
+        slot_path = path if slot == 0 else f"{path}.{slot}"
+        journal = EditJournal(slot_path, snapshot_every)
+        if journal.lock():
+            if slot:
+                print(f"Журнал правок {path} занят другим редактором, правки пишутся в {slot_path}")
+            return journal
+    return None
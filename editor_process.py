@@ -0,0 +1,76 @@
+"""
+Процесс редактора масок, запускаемый из плеера по клавише E.
+
+Обычный режим: редактор запускается с нуля, и до появления окна уходят
+секунды на импорт Qt и NumPy. Режим prewarm: процесс запускается заранее
+со скрытым окном (shape_editor.py --hidden) и ждёт команд в stdin, одна
+строка - одна команда. Показ - это команда "show", окно появляется сразу.
+Закрытое окно только прячется, и в следующий раз показывается тот же
+процесс со всеми фигурами. Когда плеер закрывает stdin (выход или
+падение), редактор завершается сам.
+"""
+import os
+import subprocess
+import sys
+
+EDITOR_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shape_editor.py')
+
+
+class EditorProcess:
+    """Процесс shape_editor.py, холодный или заранее запущенный скрытым"""
+
+    def __init__(self, prewarm=False, args=()):
+        self.prewarm = prewarm
+        self.args = list(args)  # Дополнительные аргументы командной строки редактора
+        self._process = None
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        """Запускает процесс: скрытым в режиме prewarm, иначе сразу с окном"""
+        command = [sys.executable, EDITOR_SCRIPT] + self.args
+        if self.prewarm:
+            self._process = subprocess.Popen(command + ['--hidden'], stdin=subprocess.PIPE,
+                                             text=True, encoding='utf-8')
+        else:
+            self._process = subprocess.Popen(command)
+
+    def show(self):
+        """Показывает окно редактора, при необходимости запуская процесс"""
+        if self.running:
+            if not self.prewarm:
+                print("Редактор уже запущен.")
+                return
+        else:
+            print("Запускаем редактор масок...")
+            self.start()
+            if not self.prewarm:
+                return
+        self._send('show')
+
+    def _send(self, command):
+        try:
+            self._process.stdin.write(command + '\n')
+            self._process.stdin.flush()
+        except OSError as e:
+            print(f"Редактор не принял команду {command}: {e}")
+
+    def close(self, timeout=5.0):
+        """
+        Завершает заранее запущенный редактор. Обычный редактор - отдельное
+        приложение, он остаётся открытым и после выхода из плеера.
+        """
+        process, self._process = self._process, None
+        if process is None or not self.prewarm:
+            return
+        try:
+            # Конец stdin - сигнал редактору сохранить журнал правок и выйти
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.terminate()
@@ -0,0 +1,144 @@
+"""
+Превью текущего кадра плеера для редактора через разделяемую память.
+
+Плеер пишет уменьшенную копию кадра (BGR, 8 бит) в блок
+multiprocessing.shared_memory, редактор копирует её к себе и показывает
+как фон холста. Заголовок блока: счётчик последовательности, размер
+превью и счётчик пульса. Нечётный счётчик последовательности означает,
+что кадр сейчас пишется; копия годится, только если счётчик до и после
+копирования один и тот же и чётный. Пульс плеер увеличивает и на паузе,
+когда новых кадров нет: по нему читатель отличает паузу от перезапуска.
+"""
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+PREVIEW_NAME = "tro_preview"
+HEADER = struct.Struct('<QIIQ')  # счётчик последовательности, ширина, высота, пульс
+HEADER_SIZE = 64                # данные кадра выровнены по 64 байтам
+CHANNELS = 3
+# Без пульса дольше этого читатель переподключается: плеер мог перезапуститься
+STALE_TIMEOUT = 2.0
+BEAT_OFFSET = 16  # Смещение счётчика пульса в заголовке
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # До Python 3.13 resource_tracker удалил бы чужой блок при выходе редактора
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return shm
+
+
+class PreviewPublisher:
+    """Сторона плеера: владеет блоком памяти и публикует в него кадры."""
+
+    def __init__(self, width, height, name=PREVIEW_NAME):
+        self.size = (width, height)
+        nbytes = HEADER_SIZE + width * height * CHANNELS
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=nbytes)
+        except FileExistsError:
+            # Блок остался от упавшего плеера
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=nbytes)
+        self.seq = np.ndarray((1,), dtype=np.uint64, buffer=self.shm.buf)
+        self.beat = np.ndarray((1,), dtype=np.uint64, buffer=self.shm.buf, offset=BEAT_OFFSET)
+        HEADER.pack_into(self.shm.buf, 0, 0, width, height, 0)
+        # Сюда вызывающий код пишет кадр между begin() и commit()
+        self.image = np.ndarray((height, width, CHANNELS), dtype=np.uint8,
+                                buffer=self.shm.buf, offset=HEADER_SIZE)
+
+    def begin(self):
+        self.seq[0] += 1
+
+    def commit(self):
+        self.seq[0] += 1
+
+    def heartbeat(self):
+        """Плеер жив, даже если кадры не меняются (пауза)"""
+        self.beat[0] += 1
+
+    def close(self):
+        self.seq = None
+        self.beat = None
+        self.image = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class PreviewReader:
+    """Сторона редактора: подключается к блоку плеера, когда тот появится."""
+
+    def __init__(self, name=PREVIEW_NAME):
+        self.name = name
+        self.shm = None
+        self.image = None
+        self.width = 0
+        self.height = 0
+        self.last_seq = None  # Последний скопированный кадр
+        self.last_state = None  # Счётчики кадра и пульса при последней проверке
+        self.last_change = 0.0
+
+    def attach(self):
+        """Пытается подключиться к блоку. Возвращает True при успехе."""
+        if self.shm is not None:
+            return True
+        try:
+            self.shm = _attach(self.name)
+        except FileNotFoundError:
+            return False
+        _, self.width, self.height, _ = HEADER.unpack_from(self.shm.buf, 0)
+        self.image = np.ndarray((self.height, self.width, CHANNELS), dtype=np.uint8,
+                                buffer=self.shm.buf, offset=HEADER_SIZE)
+        self.last_seq = None
+        self.last_state = None
+        self.last_change = time.monotonic()
+        return True
+
+    def read(self, out):
+        """
+        Копирует в out (высота x ширина x 3) кадр, опубликованный с прошлого
+        вызова. Возвращает True, если скопирован целый новый кадр; кадр,
+        который плеер переписал во время копирования, берётся на следующем вызове.
+        """
+        if self.shm is None:
+            return False
+        seq = HEADER.unpack_from(self.shm.buf, 0)[0]
+        if seq % 2 or seq == self.last_seq:
+            return False
+        np.copyto(out, self.image)
+        if HEADER.unpack_from(self.shm.buf, 0)[0] != seq:
+            return False
+        self.last_seq = seq
+        return True
+
+    def is_stale(self):
+        """Плеер давно не подаёт пульса: он мог перезапуститься с новым блоком."""
+        if self.shm is None:
+            return False
+        seq, _, _, beat = HEADER.unpack_from(self.shm.buf, 0)
+        now = time.monotonic()
+        if (seq, beat) != self.last_state:
+            self.last_state = (seq, beat)
+            self.last_change = now
+        return now - self.last_change > STALE_TIMEOUT
+
+    def close(self):
+        if self.shm is not None:
+            self.image = None
+            self.shm.close()
+            self.shm = None
@@ -0,0 +1,86 @@
+"""
+Кэш декодированных кадров для бесшовного зацикливания коротких роликов.
+
+На первом проходе поток декодирования складывает каждый кадр в заранее
+выделенный буфер, а дальше ролик играет из него: без декодера и без
+перемотки в начало файла. Буфер лежит в памяти, если помещается в
+бюджет, иначе - в сыром файле на диске, отображённом в память.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+MB = 1024 * 1024
+
+
+class LoopCache:
+    """Кадры ролика (N, высота, ширина, каналы) в памяти или в файле на диске"""
+
+    def __init__(self, capacity, shape, path=None, dtype=np.uint8):
+        self.capacity = capacity
+        self.path = path
+        if path is None:
+            self.frames = np.empty((capacity,) + tuple(shape), dtype=dtype)
+        else:
+            self.frames = np.memmap(path, dtype=dtype, mode='w+', shape=(capacity,) + tuple(shape))
+        self.count = 0  # Сколько кадров записано
+        self.complete = False  # Записан весь ролик, можно играть из кэша
+
+    @classmethod
+    def create(cls, frame_count, shape, memory_budget, disk_budget=0, directory=None):
+        """
+        Выделяет кэш под frame_count кадров или возвращает None, если ролик
+        не помещается ни в memory_budget, ни в disk_budget (байты).
+        """
+        if frame_count <= 0:
+            return None
+        nbytes = frame_count * int(np.prod(shape))
+        if nbytes <= memory_budget:
+            try:
+                return cls(frame_count, shape)
+            except MemoryError:
+                print(f"Не удалось выделить {nbytes / MB:.0f} МБ под кэш цикла в памяти")
+        if nbytes <= disk_budget:
+            fd, path = tempfile.mkstemp(prefix='tro_loop_', suffix='.raw', dir=directory)
+            os.close(fd)
+            try:
+                return cls(frame_count, shape, path=path)
+            except OSError as e:
+                os.remove(path)
+                print(f"Не удалось создать кэш цикла на диске: {e}")
+        return None
+
+    @property
+    def nbytes(self):
+        return self.frames.nbytes
+
+    def store(self, frame):
+        """Дописывает кадр первого прохода. False - ролик длиннее кэша."""
+        if self.count >= self.capacity:
+            return False
+        self.frames[self.count] = frame
+        self.count += 1
+        return True
+
+    def finish(self):
+        """Конец первого прохода: дальше кадры берутся из кэша."""
+        self.complete = self.count > 0
+        return self.complete
+
+    def frame(self, index):
+        return self.frames[index % self.count]
+
+    def close(self):
+        frames, self.frames = self.frames, None
+        self.complete = False
+        if self.path is not None:
+            # На Windows отображённый файл нельзя удалить, пока он открыт
+            mmap = getattr(frames, '_mmap', None)
+            if mmap is not None:
+                mmap.close()
+            del frames
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
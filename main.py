@@ -1,82 +1,873 @@
+import startup  # Первым: от его импорта считается время запуска
 import cv2
 import numpy as np
 import json
 import os
+import argparse
+import copy
 import glob
-import sys
-from PyQt6.QtWidgets import QApplication
 import threading
-import socket
+import time
 import queue
-import subprocess # Для запуска редактора как отдельного процесса
+from collections import OrderedDict
+
+# Qt плееру не нужен: окна - cv2.imshow, редактор - отдельный процесс (см. editor_process).
+# Модули для необязательных режимов (compositor, batch_render) импортируются по требованию
+import control_server
+import editor_process
+import frame_preview
+import loop_cache
+import mask_library
+import mask_protocol
+import metrics
+import playlist
+
+startup.mark("импорт модулей")
+
+MASK_CACHE_BYTES = 256 * loop_cache.MB  # Бюджет кэша анимированных масок одного выхода
+
+
+class CompiledMask:
+    """
+    Растеризованная объединённая маска для конкретного размера кадра.
+
+    Строится один раз при смене набора масок или размера кадра и хранит
+    ограничивающий прямоугольник объединения, чтобы маски, покрывающие
+    небольшую область, накладывались только на эту область кадра.
+    """
+    # Доля площади кадра, ниже которой выгоднее работать с вырезанной областью
+    CROP_THRESHOLD = 0.5
+
+    def __init__(self, polygons, width, height, base=None, striped=None):
+        self.width = width
+        self.height = height
+        # base - готовый растр (например, из библиотеки масок), полигоны дорисовываются поверх
+        if base is None:
+            self.raster = np.zeros((height, width), dtype=np.uint8)
+        else:
+            self.raster = base.copy()
+        # Заливаем по одному полигону: общий вызов fillPoly даёт дыры в пересечениях
+        if striped is not None and len(polygons) > 1 and striped.enabled_for(height, width):
+            striped.fill(self.raster, polygons)
+        else:
+            for points in polygons:
+                cv2.fillPoly(self.raster, [points], 255)
+
+        self.bbox = None
+        self.crop = None
+        rects = [cv2.boundingRect(points) for points in polygons]
+        if base is not None:
+            rect = cv2.boundingRect(base)
+            if rect[2] and rect[3]:
+                rects.append(rect)
+        if rects:
+            x0, y0 = width, height
+            x1, y1 = 0, 0
+            for x, y, w, h in rects:
+                x0, y0 = min(x0, x), min(y0, y)
+                x1, y1 = max(x1, x + w), max(y1, y + h)
+            x0, y0 = max(x0, 0), max(y0, 0)
+            x1, y1 = min(x1, width), min(y1, height)
+            if x1 > x0 and y1 > y0:
+                self.bbox = (x0, y0, x1, y1)
+                self.crop = self.raster[y0:y1, x0:x1]
+        self._expanded = None
+
+    @classmethod
+    def from_masks(cls, masks, width, height, time=None, base=None, striped=None):
+        """
+        Компилирует маски с нормализованными координатами под размер кадра.
+
+        time - момент видео в секундах для масок с ключевыми кадрами,
+        None - их статичные точки. striped - StripedCompositor для
+        заливки полигонов больших кадров на нескольких потоках.
+        """
+        scale = np.array([width, height], dtype=np.float32)
+        polygons = [(mask_points(mask_data, time) * scale).astype(np.int32) for mask_data in masks]
+        return cls(polygons, width, height, base, striped)
+
+    @property
+    def nbytes(self):
+        """Оценка занимаемой памяти: растр и копия на 3 канала для cv2.bitwise_and (см. _mask_for)"""
+        expanded = self.crop if self.crop is not None and self.is_small() else self.raster
+        return self.raster.nbytes + expanded.nbytes * 3
+
+    def matches(self, width, height):
+        return self.width == width and self.height == height
+
+    def is_small(self):
+        """Покрывает ли объединение масок небольшую часть кадра."""
+        if self.bbox is None:
+            return True
+        x0, y0, x1, y1 = self.bbox
+        return (x1 - x0) * (y1 - y0) < self.CROP_THRESHOLD * self.width * self.height
+
+    def _mask_for(self, frame):
+        """
+        Маска с тем же числом каналов, что и кадр (кэшируется).
+
+        Для небольших масок - только вырезанная область bbox: остальная
+        часть кадра обнуляется без маски.
+        """
+        source = self.crop if self.is_small() and self.crop is not None else self.raster
+        if frame.ndim == 2:
+            return source
+        channels = frame.shape[2]
+        if self._expanded is None or self._expanded.shape[2] != channels:
+            self._expanded = cv2.merge([source] * channels)
+        return self._expanded
+
+    def apply(self, frame, out=None, striped=None):
+        """
+        Оставляет в кадре только пиксели под маской.
+
+        Если передан out, результат пишется в него без выделения памяти;
+        out может совпадать с frame. striped - StripedCompositor: большой
+        кадр обрабатывается полосами строк на его потоках.
+        """
+        if out is None:
+            out = np.empty_like(frame)
+        if self.bbox is None:
+            out[...] = 0
+            return out
+        mask = self._mask_for(frame)
+        height, width = frame.shape[:2]
+        if striped is not None and striped.enabled_for(height, width):
+            striped.run(lambda start, end: self._apply_rows(frame, mask, out, start, end), height)
+        else:
+            self._apply_rows(frame, mask, out, 0, height)
+        return out
+
+    def _apply_rows(self, frame, mask, out, start, end):
+        """Накладывает маску на строки [start, end) кадра."""
+        if not self.is_small():
+            cv2.bitwise_and(frame[start:end], mask[start:end], dst=out[start:end])
+            return
+        x0, y0, x1, y1 = self.bbox
+        y0, y1 = max(y0, start), min(y1, end)
+        if y0 >= y1:
+            out[start:end] = 0
+            return
+        out[start:y0] = 0
+        out[y1:end] = 0
+        out[y0:y1, :x0] = 0
+        out[y0:y1, x1:] = 0
+        top = self.bbox[1]
+        cv2.bitwise_and(frame[y0:y1, x0:x1], mask[y0 - top:y1 - top], dst=out[y0:y1, x0:x1])
+
+
+class MaskCache:
+    """
+    Кэш растеризованных масок с ограничением по памяти.
+
+    Ключ - размер кадра и квантованное время, поэтому на зацикленном
+    видео анимированные маски растеризуются только на первом проходе.
+    Петля читается по кругу, и при вытеснении давно не нужных масок любой
+    петле длиннее бюджета досталось бы 0% попаданий: поэтому маски
+    текущего размера кадра не вытесняются, а когда петля не помещается,
+    кэшируется её начало и об этом сообщается один раз.
+    Доступен из потока декодирования и потока показа одновременно.
+    """
+    def __init__(self, max_bytes=MASK_CACHE_BYTES, loop_steps=0):
+        self.max_bytes = max_bytes
+        self.loop_steps = loop_steps  # Шагов времени в петле ролика, 0 - неизвестно
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.overflowed = False
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            compiled = self._items.get(key)
+            if compiled is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return compiled
+
+    def put(self, key, compiled):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            # Маски прежнего размера кадра больше не понадобятся, освобождаем место от них
+            size = key[:2]
+            for old_key in list(self._items):
+                if self.nbytes + compiled.nbytes <= self.max_bytes:
+                    break
+                if old_key[:2] != size:
+                    self.nbytes -= self._items.pop(old_key).nbytes
+            # Последнюю маску оставляем, даже если она одна больше бюджета
+            if self._items and self.nbytes + compiled.nbytes > self.max_bytes:
+                if not self.overflowed:
+                    self.overflowed = True
+                    self._report_overflow(compiled.nbytes)
+                return
+            self._items[key] = compiled
+            self.nbytes += compiled.nbytes
+
+    def _report_overflow(self, entry_bytes):
+        budget = self.max_bytes / loop_cache.MB
+        if self.loop_steps:
+            need = self.loop_steps * entry_bytes / loop_cache.MB
+            print(f"Кэш масок: петля из {self.loop_steps} шагов требует ~{need:.0f} МБ при бюджете "
+                  f"{budget:.0f} МБ, кэшируются первые {len(self._items)} шагов")
+        else:
+            print(f"Кэш масок: бюджет {budget:.0f} МБ заполнен, кэшируются первые {len(self._items)} шагов")
+
+    def __len__(self):
+        return len(self._items)
+
+
+class FrameRingBuffer:
+    """
+    Кольцевой буфер кадров фиксированного размера с заранее выделенной памятью.
+
+    Поток декодирования пишет в слоты raw (исходный кадр) и frames[выход]
+    (кадр выхода с коррекцией и маской), поток показа читает их по порядку.
+    Слоты выходов выделены под наибольший размер выхода, кадр меньшего
+    размера занимает начало слота (см. output_view).
+    Текущий показываемый слот удерживается читателем до перехода к
+    следующему, поэтому на паузе кадр остаётся валидным.
+    """
+    def __init__(self, capacity, shape, output_shapes, dtype=np.uint8):
+        self.capacity = capacity
+        self.raw = np.empty((capacity,) + tuple(shape), dtype=dtype)
+        self.frames = {name: np.empty((capacity,) + tuple(out_shape), dtype=dtype)
+                       for name, out_shape in output_shapes.items()}
+        # Версия масок, с которой был подготовлен слот, и готовый к показу кадр
+        # каждого выхода: часть frames[выход] или сам raw, если обработка не нужна
+        self.stamps = [None] * capacity
+        self.shown = {name: [None] * capacity for name in output_shapes}
+        self.times = [0.0] * capacity  # Время кадра в видео, секунды
+        self.clips = [0] * capacity  # Номер переключения плейлиста, к которому относится кадр
+        self._written = 0
+        self._read = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def output_view(self, name, index, width, height):
+        """Непрерывный кадр width x height в начале слота выхода, без копирования"""
+        slot = self.frames[name][index]
+        channels = slot.shape[2]
+        return slot.reshape(-1)[:height * width * channels].reshape(height, width, channels)
+
+    def reserve(self, timeout=None):
+        """Ждёт свободный слот для записи. Возвращает его индекс или None."""
+        with self._cond:
+            if not self._cond.wait_for(
+                    lambda: self._closed or self._written - self._read < self.capacity, timeout):
+                return None
+            if self._closed:
+                return None
+            return self._written % self.capacity
+
+    def commit(self):
+        """Публикует записанный слот для потока показа."""
+        with self._cond:
+            self._written += 1
+            self._cond.notify_all()
+
+    def ready(self):
+        """Количество записанных, но ещё не освобождённых кадров."""
+        with self._cond:
+            return self._written - self._read
+
+    def slot(self, offset=0):
+        return (self._read + offset) % self.capacity
+
+    def release(self):
+        """Освобождает самый старый слот для повторной записи."""
+        with self._cond:
+            self._read += 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class MaskOutput:
+    """
+    Один выход плеера (окно на своём проекторе) со своим набором масок.
+
+    Все выходы получают один и тот же декодированный кадр. Коррекция
+    перспективы задаётся углами: куда на выходе (0..1) попадают углы
+    исходного кадра TL, TR, BR, BL. По ним один раз строятся карты
+    cv2.remap, и они переиспользуются, пока не сменится калибровка или
+    размер, так что каждый выход стоит одного remap и одного наложения маски.
+    """
+    IDENTITY = np.float32([[0, 0], [1, 0], [1, 1], [0, 1]])
+
+    def __init__(self, name, window, size=None, corners=None):
+        self.name = name
+        self.window = window
+        self.size = tuple(size) if size else None  # (ширина, высота), None - как у видео
+        # Размер обработки по фактическому размеру окна (только для выходов без size):
+        # кадр уменьшается один раз, и маска накладывается уже на уменьшенный
+        self.display_size = None
+        self.striped = None  # StripedCompositor для больших кадров, None - один поток
+        self.corners = None
+        self.compiled_mask = None  # Кэш растеризованной статичной маски, см. CompiledMask
+        # Анимированные маски растеризуются с шагом time_quantum секунд (по умолчанию - кадр)
+        self.time_quantum = 1.0 / 30.0
+        self.loop_steps = 0  # Кадров в ролике - столько масок нужно кэшу на всю петлю
+        # Файлы библиотеки масок: путь -> (MaskFile, маски); их готовые растры объединяются
+        # в _library_rasters, маски редактора (masks) дорисовываются поверх
+        self.library = {}
+        self._library_rasters = {}
+        self.masks = []
+        self._warp_key = None
+        self._warp_maps = None
+        self.set_calibration(corners)
+
+    @property
+    def masks(self):
+        """Маски, пришедшие от редактора (без библиотеки)"""
+        return self._masks
+
+    @masks.setter
+    def masks(self, masks):
+        self._masks = masks
+        self._update_masks()
+
+    def with_masks(self, masks):
+        """Копия выхода с другими масками редактора; окно, размер, калибровка и библиотека - те же"""
+        clone = copy.copy(self)
+        clone.library = dict(self.library)
+        clone.masks = masks
+        return clone
+
+    def set_library_file(self, mask_file, masks):
+        self.library[mask_file.path] = (mask_file, masks)
+        self._library_rasters = {}
+        self._update_masks()
+
+    def remove_library_file(self, path):
+        if self.library.pop(path, None) is not None:
+            self._library_rasters = {}
+            self._update_masks()
+
+    def refresh_library_rasters(self):
+        """Файлы библиотеки получили точные растры нового размера - собрать объединение заново"""
+        self._library_rasters = {}
+        self._update_masks()
+
+    def _update_masks(self):
+        self.all_masks = self._masks + [m for _, masks in self.library.values() for m in masks]
+        # Маски, которых нет в готовых растрах библиотеки: заливаются при компиляции
+        self._filled_masks = self._masks + [m for mask_file, masks in self.library.values()
+                                            if mask_file.animated for m in masks]
+        self.animated = any(mask_data.get('keyframes') is not None for mask_data in self.all_masks)
+        self.compiled_mask = None
+        # Новый кэш вместо очистки: поток декодирования может ещё читать старый
+        self.mask_cache = MaskCache(loop_steps=self.loop_steps)
+
+    def library_raster(self, width, height):
+        """Объединение готовых растров статичных файлов библиотеки или None"""
+        key = (width, height)
+        if key not in self._library_rasters:
+            base = None
+            for mask_file, masks in self.library.values():
+                if mask_file.animated:
+                    continue
+                raster = mask_file.raster(width, height)
+                if raster is None:
+                    # Точный растр для нового размера окна строит поток библиотеки
+                    raster = mask_file.scaled_raster(width, height)
+                if raster is None:
+                    raster = CompiledMask.from_masks(masks, width, height).raster
+                base = raster if base is None else cv2.bitwise_or(base, raster, dst=base)
+            while len(self._library_rasters) >= mask_library.MAX_RASTERS:
+                self._library_rasters.pop(next(iter(self._library_rasters)), None)
+            self._library_rasters[key] = base
+        return self._library_rasters[key]
+
+    def set_calibration(self, corners):
+        """Задаёт углы коррекции (4 x 2 в 0..1) или None - без коррекции."""
+        if corners is None:
+            self.corners = None
+        else:
+            self.corners = np.asarray(corners, dtype=np.float32).reshape(4, 2).copy()
+
+    def frame_size(self, width, height):
+        return self.size or self.display_size or (width, height)
+
+    def max_frame_size(self, width, height):
+        """Наибольший размер кадра выхода: окно не увеличивает кадр больше исходного"""
+        return self.size or (width, height)
+
+    def fit_display(self, width, height, window_width, window_height):
+        """
+        Подбирает размер обработки под окно window_width x window_height.
+
+        Возвращает True, если размер изменился.
+        """
+        if self.size is not None or window_width <= 0 or window_height <= 0:
+            return False
+        scale = min(window_width / width, window_height / height)
+        size = None
+        if scale < 1.0:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if size == self.display_size:
+            return False
+        self.display_size = size
+        return True
+
+    def warp_maps(self, width, height, out_w, out_h):
+        """Карты cv2.remap из кадра выхода out_w x out_h в исходный кадр width x height (кэшируются)."""
+        corners = self.IDENTITY if self.corners is None else self.corners
+        key = (width, height, out_w, out_h, corners.tobytes())
+        if key != self._warp_key:
+            src = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+            dst = corners * np.float32([out_w, out_h])
+            # Обратное преобразование: для каждого пикселя выхода - точка в исходном кадре
+            inverse = cv2.getPerspectiveTransform(dst, src)
+            xs, ys = np.meshgrid(np.arange(out_w, dtype=np.float32), np.arange(out_h, dtype=np.float32))
+            grid = np.dstack([xs, ys]).reshape(-1, 1, 2)
+            mapped = cv2.perspectiveTransform(grid, inverse).reshape(out_h, out_w, 2)
+            self._warp_maps = cv2.convertMaps(mapped, None, cv2.CV_16SC2)
+            self._warp_key = key
+        return self._warp_maps
+
+    def compiled(self, width, height, time=None):
+        """Маска под размер кадра; для анимированных масок - на момент time из LRU кэша."""
+        if time is None or not self.animated:
+            compiled = self.compiled_mask
+            if compiled is None or not compiled.matches(width, height):
+                compiled = self.compiled_mask = CompiledMask.from_masks(
+                    self._filled_masks, width, height, base=self.library_raster(width, height),
+                    striped=self.striped)
+            return compiled
+        cache = self.mask_cache
+        step = round(time / self.time_quantum)
+        key = (width, height, step)
+        compiled = cache.get(key)
+        if compiled is None:
+            compiled = CompiledMask.from_masks(self._filled_masks, width, height, time=step * self.time_quantum,
+                                               base=self.library_raster(width, height), striped=self.striped)
+            cache.put(key, compiled)
+        return compiled
+
+    def render(self, raw, out, apply_mask, time=None):
+        """
+        Готовит кадр выхода из исходного кадра raw на момент time видео.
+
+        out - буфер размера frame_size(). Возвращает out, если кадр записан
+        в него, или сам raw, когда выходу не нужны ни масштаб, ни коррекция,
+        ни маска.
+        """
+        height, width = raw.shape[:2]
+        out_h, out_w = out.shape[:2]
+        masked = apply_mask and bool(self.all_masks)
+        if self.corners is not None:
+            map1, map2 = self.warp_maps(width, height, out_w, out_h)
+            cv2.remap(raw, map1, map2, cv2.INTER_LINEAR, dst=out,
+                      borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+            frame = out
+        elif (out_w, out_h) != (width, height):
+            # Только масштаб: уменьшаем один раз, маска дальше - в размере выхода
+            cv2.resize(raw, (out_w, out_h), dst=out, interpolation=cv2.INTER_AREA)
+            frame = out
+        elif masked:
+            frame = raw
+        else:
+            return raw
+        if masked:
+            self.compiled(out_w, out_h, time).apply(frame, out=out, striped=self.striped)
+        return out
+
+
+def load_outputs_file(filename):
+    """
+    Читает описание выходов: список {"name", "size": [w, h], "corners": [[x, y] x 4]}.
+
+    size и corners необязательны.
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return data.get('outputs', [])
+    return data
+
+
+def parse_keyframes(shape_data, fps=30.0):
+    """
+    Ключевые кадры фигуры: [{"time": секунды или "frame": номер кадра, "points": [...]}].
+
+    Возвращает (времена, точки K x N x 2) по возрастанию времени или None,
+    если ключей нет или у них разное число вершин.
+    """
+    keyframes = shape_data.get('keyframes')
+    if not keyframes:
+        return None
+    times = []
+    points = []
+    for keyframe in keyframes:
+        times.append(float(keyframe['time']) if 'time' in keyframe else keyframe['frame'] / fps)
+        points.append(np.asarray(keyframe['points'], dtype=np.float32).reshape(-1, 2))
+    if len({len(p) for p in points}) != 1:
+        print(f"Предупреждение: у ключевых кадров фигуры {shape_data.get('id')} разное число вершин, "
+              f"анимация пропущена")
+        return None
+    order = np.argsort(times, kind='stable')
+    return np.asarray(times, dtype=np.float64)[order], np.stack(points)[order]
+
+
+def mask_points(mask_data, time=None):
+    """Нормализованные точки маски в момент time: вершины интерполируются между ключами."""
+    keyframes = mask_data.get('keyframes')
+    if keyframes is None or time is None:
+        return mask_data['normalized']
+    times, points = keyframes
+    if time <= times[0]:
+        return points[0]
+    if time >= times[-1]:
+        return points[-1]
+    i = int(np.searchsorted(times, time, side='right'))
+    weight = np.float32((time - times[i - 1]) / (times[i] - times[i - 1]))
+    return points[i - 1] + (points[i] - points[i - 1]) * weight
+
+
+def build_masks(shapes_data, width, height, source="Editor", fps=30.0):
+    """Строит список масок из замкнутых фигур редактора (координаты 0..1)."""
+    masks = []
+    scale = np.array([width, height], dtype=np.float32)
+    for i, shape_data in enumerate(shapes_data):
+        if shape_data.get('is_closed'):
+            shape_id = shape_data.get('id', i)
+            keyframes = parse_keyframes(shape_data, fps)
+            if 'points' in shape_data:
+                normalized = np.asarray(shape_data['points'], dtype=np.float32).reshape(-1, 2)
+            elif keyframes is not None:
+                normalized = keyframes[1][0]
+            else:
+                continue
+            masks.append({
+                'id': shape_id,
+                'points': (normalized * scale).astype(np.int32),
+                'normalized': normalized,
+                'keyframes': keyframes,
+                'name': f"{source}_Shape_{shape_id+1}",
+                'file': source
+            })
+    return masks
+
+
+def load_shapes_file(filename):
+    """Читает фигуры из JSON, сохранённого редактором (CanvasWidget.save_to_json)."""
+    with open(filename, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return data.get('shapes', [])
+    return data
+
 
 class VideoMaskPlayer:
-    def __init__(self, app):
+    WINDOW_NAME = 'Video Mask Player'
+
+    def __init__(self):
         self.video_path = "C:/Users/multi/Desktop/TRO/2.mov"
         self.cap = None
-        self.masks = []
+        # Выходы по имени: у каждого свои маски и своя коррекция перспективы
+        self.outputs = {}
+        self.add_output(mask_protocol.DEFAULT_OUTPUT)
         self.apply_mask = False # Изначально маска выключена, пока не придут данные
         self.is_playing = True
         self.is_fullscreen = False
-        self.app = app
         self.width = 1280  # Размеры по умолчанию
         self.height = 720
+        self.fps = 30.0
+        self._frame_index = 0  # Номер следующего декодируемого кадра, задаёт время анимации масок
+
+        # Кэш цикла (см. loop_cache): бюджеты в байтах, 0 - кэш выключен
+        self.loop_cache_memory = 0
+        self.loop_cache_disk = 0
+        self.loop_cache_dir = None
+        self.loop_cache = None
+
+        # Каталог библиотеки масок (см. mask_library), None - не используется
+        self.mask_library_dir = None
+        self.library_interval = 1.0
+        self.mask_library = None
+        self._library_sizes = queue.SimpleQueue()  # Выходы, сменившие размер обработки
+
+        # Плейлист (см. playlist): элементы {'video', 'masks', 'loops'}, пустой - один ролик по кругу
+        self.playlist = []
+        self.playlist_index = 0
+        self.prefetch_frames = 12
+        self.prefetcher = None
+        self._clip = None  # Текущий ролик плейлиста, пока у него остаются заранее декодированные кадры
+        self._clip_serial = 0  # Номер переключения или перемотки, им помечаются слоты буфера
+        self._shown_clip = 0
+        # Номер переключения -> выходы с масками нового ролика, пока его кадры не показаны
+        self._clip_outputs = {}
+        self._plays = 0
+        self._skip_request = 0
+        self._seek_request = None  # Номер кадра, на который перемотает поток декодирования
+
+        # Конвейер воспроизведения: поток декодирования -> кольцевой буфер -> показ
+        self.ring_capacity = 4
+        # Обрабатывать кадр в размере окна, а не исходного видео
+        self.adaptive_resolution = True
+        # Наложение масок полосами на нескольких потоках (см. compositor), 0 или 1 - выключено
+        self.composite_threads = 0
+        self.striped = None
+        self._next_size_check = 0.0
+        self.mask_version = 0  # Увеличивается при любой смене масок или их включения
+        self.stats = {'presented': 0, 'dropped': 0, 'repeated': 0}
+        self._stop_event = threading.Event()
+
+        # Превью кадра для фона редактора (см. frame_preview), 0 Гц - выключено
+        self.preview_rate = 10.0
+        self.preview_width = 640
+        self.preview = None
+        self._last_preview = 0.0
+
+        # Замеры стадий кадра: собираются, только пока включён оверлей или выгрузка
+        self.metrics = metrics.StageMetrics()
+        self.show_overlay = False
+        self.metrics_file = None
+        self.metrics_port = None
+        self.metrics_interval = 5.0
+
+        # Редактор масок по клавише E; prewarm - заранее запущенный скрытый процесс
+        self.editor = editor_process.EditorProcess()
+        self.startup_report = False  # Напечатать время запуска после первого кадра
         
         # Очередь для безопасной передачи данных между потоками
         self.mask_queue = queue.Queue()
+        # Команды сервера управления (см. control_server), разбираются циклом показа
+        self.control_queue = queue.SimpleQueue()
+        self.server = None
+        # Состояние для запросов status: время показанного кадра и измеренная частота показа
+        self.shown_time = 0.0
+        self.display_fps = 0.0
         
-    def _start_socket_server(self):
-        """Запускает сервер в фоновом потоке для приема масок."""
-        HOST, PORT = "localhost", 12345
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind((HOST, PORT))
-            s.listen()
-            print(f"Сервер слушает на {HOST}:{PORT}")
-            while True:
-                conn, addr = s.accept()
-                with conn:
-                    print(f"Подключился {addr}")
-                    data = b''
-                    while True:
-                        chunk = conn.recv(1024)
-                        if not chunk:
-                            break
-                        data += chunk
-                    if data:
-                        try:
-
-                            shapes_data = json.loads(data.decode('utf-8'))
-                            self.mask_queue.put(shapes_data)
-                            print(f"Получены новые маски от клиента ({len(shapes_data)} шт.)")
-                        except json.JSONDecodeError:
-                            print("Ошибка: получены некорректные JSON данные")
-
-    def set_mask_from_editor(self, shapes_data):
-        """Устанавливает маски, полученные от редактора через сокет."""
-        self.masks = []
-        for i, shape_data in enumerate(shapes_data):
-            if shape_data.get('is_closed'):
-                points_list = shape_data['points']
-                points = np.array(
-                    [[int(x * self.width), int(y * self.height)] for x, y in points_list],
-                    dtype=np.int32
-                )
-                self.masks.append({
-                    'points': points,
-                    'name': f"Editor_Shape_{i+1}",
-                    'file': "Editor"
-                })
-        print(f"Маски из редактора установлены. Всего масок: {len(self.masks)}")
-        self.apply_mask = True 
-        
+    def add_output(self, name, size=None, corners=None):
+        """Добавляет выход (или заменяет калибровку существующего)."""
+        output = self.outputs.get(name)
+        if output is not None:
+            output.size = tuple(size) if size else None
+            output.set_calibration(corners)
+            return output
+        window = self.WINDOW_NAME if name == mask_protocol.DEFAULT_OUTPUT else f"{self.WINDOW_NAME} - {name}"
+        output = self.outputs[name] = MaskOutput(name, window, size, corners)
+        return output
+
+    def configure_outputs(self, configs):
+        for config in configs:
+            self.add_output(config['name'], config.get('size'), config.get('corners'))
+        print(f"Выходов: {len(self.outputs)} ({', '.join(self.outputs)})")
+
+    def _output(self, name):
+        output = self.outputs.get(name)
+        if output is None:
+            print(f"Предупреждение: неизвестный выход '{name}', обновление пропущено")
+        return output
+
+    def _output_size(self, output):
+        return output.frame_size(self.width, self.height)
+
+    @property
+    def masks(self):
+        """Маски основного выхода, включая библиотеку."""
+        return self.outputs[mask_protocol.DEFAULT_OUTPUT].all_masks
+
+    CONTROL_COMMANDS = ('play', 'pause', 'toggle_play', 'toggle_mask', 'seek', 'skip')
+
+    def submit_control(self, command):
+        """
+        Принимает команду управления от клиента сервера (из его потока).
+
+        Сама команда выполняется циклом показа между кадрами, здесь она
+        только проверяется и ставится в очередь. Возвращает текст ошибки
+        или None.
+        """
+        name = command.get('cmd')
+        if name not in self.CONTROL_COMMANDS:
+            return f"неизвестная команда {name!r}"
+        if name == 'skip':
+            if len(self.playlist) < 2:
+                return "плейлист не задан"
+            self.request_skip(int(command.get('offset', 1)))
+            return None
+        value = None
+        if name == 'seek':
+            if 'frame' in command:
+                value = int(command['frame'])
+            elif 'time' in command:
+                value = round(float(command['time']) * self.fps)
+            else:
+                return "для seek нужен frame или time"
+            value = max(0, value)
+        self.control_queue.put((name, value))
+        return None
+
+    def _take_controls(self):
+        while True:
+            try:
+                yield self.control_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def status(self):
+        """
+        Состояние плеера для запроса status (вызывается из потока сервера).
+
+        Только читает поля, которые обновляют поток показа и поток
+        декодирования, без блокировок: ответ может отставать на кадр.
+        """
+        outputs = {}
+        for name, output in list(self.outputs.items()):
+            masks = output.all_masks
+            outputs[name] = {
+                'masks': [mask_data['name'] for mask_data in masks],
+                'library': [mask_file.name for mask_file, _ in list(output.library.values())],
+                'size': list(self._output_size(output)),
+            }
+        status = {
+            'video': self.video_path,
+            'playing': self.is_playing,
+            'mask_enabled': self.apply_mask,
+            'frame': round(self.shown_time * self.fps),
+            'time': self.shown_time,
+            'fps': self.fps,
+            'display_fps': self.display_fps if self.is_playing else 0.0,
+            'stats': dict(self.stats),
+            'outputs': outputs,
+        }
+        if self.playlist:
+            status['playlist'] = {'index': self.playlist_index, 'count': len(self.playlist)}
+        return status
+
+    def set_mask_from_editor(self, shapes_data, output=mask_protocol.DEFAULT_OUTPUT):
+        """Устанавливает маски выхода, полученные от редактора через сокет."""
+        output = self._output(output)
+        if output is None:
+            return
+        had_masks = bool(output.all_masks)
+        output.masks = build_masks(shapes_data, *self._output_size(output), fps=self.fps)
+        self._masks_changed(output, had_masks)
+        print(f"Маски из редактора установлены ({output.name}). Всего масок: {len(output.masks)}")
+
+    def _upsert_shape(self, output, masks, shape_data):
+        shape_id = shape_data['id']
+        masks = [m for m in masks if m['id'] != shape_id]
+        masks.extend(build_masks([shape_data], *self._output_size(output), fps=self.fps))
+        return masks
+
+    def update_mask_shape(self, shape_data, output=mask_protocol.DEFAULT_OUTPUT):
+        """Добавляет или заменяет одну фигуру выхода по id."""
+        output = self._output(output)
+        if output is None:
+            return
+        had_masks = bool(output.all_masks)
+        output.masks = self._upsert_shape(output, output.masks, shape_data)
+        self._masks_changed(output, had_masks)
+
+    def delete_mask_shape(self, shape_id, output=mask_protocol.DEFAULT_OUTPUT):
+        output = self._output(output)
+        if output is None:
+            return
+        had_masks = bool(output.all_masks)
+        output.masks = [m for m in output.masks if m['id'] != shape_id]
+        self._masks_changed(output, had_masks)
+
+    def calibrate_output(self, corners, output=mask_protocol.DEFAULT_OUTPUT):
+        """Меняет коррекцию перспективы выхода, карты remap перестроятся при следующем кадре."""
+        output = self._output(output)
+        if output is None:
+            return
+        for target in [output] + self._pending_outputs(output.name):
+            target.set_calibration(corners)
+        self.mask_version += 1
+
+    def _pending_outputs(self, name):
+        """Копии выхода name с масками роликов, кадры которых ещё не показаны"""
+        current = self.outputs.get(name)
+        pending = []
+        for outputs in list(self._clip_outputs.values()):
+            output = outputs.get(name)
+            if output is not None and output is not current and output not in pending:
+                pending.append(output)
+        return pending
+
+    def _masks_changed(self, output, had_masks):
+        """
+        had_masks - были ли у выхода маски до изменения. Маски включаются
+        только при появлении первых: выключенные оператором правки и смена
+        ролика обратно не включают.
+        """
+        output.compiled(*self._output_size(output))
+        self.mask_version += 1
+        if not had_masks and output.all_masks:
+            self.apply_mask = True
+
     def check_for_new_masks(self):
-        """Проверяет очередь на наличие новых масок и применяет их."""
-        try:
-            new_masks_data = self.mask_queue.get_nowait()
-            self.set_mask_from_editor(new_masks_data)
-        except queue.Empty:
-            # Если очередь пуста, ничего не делаем
-            pass
+        """
+        Забирает из очереди все накопившиеся обновления и применяет только итог.
+
+        Для каждого выхода полный набор отменяет всё, что пришло до него,
+        из точечных обновлений одной фигуры применяется только последнее,
+        а маска перекомпилируется один раз на кадр, сколько бы обновлений
+        ни пришло.
+        """
+        updates = {}
+        while True:
+            try:
+                name, kind, data = self.mask_queue.get_nowait()
+            except queue.Empty:
+                break
+            updates.setdefault(name, []).append((kind, data))
+
+        for name, output_updates in updates.items():
+            output = self._output(name)
+            if output is None:
+                continue
+            had_masks = bool(output.all_masks)
+            # Калибровка и библиотека не зависят от масок редактора и не отменяются полным набором
+            for kind, data in output_updates:
+                if kind == 'calibrate':
+                    self.calibrate_output(data, name)
+                elif kind == 'library':
+                    library_masks = build_masks(data.shapes, *self._output_size(output),
+                                                source=data.name, fps=self.fps)
+                    for target in [output] + self._pending_outputs(name):
+                        target.set_library_file(data, library_masks)
+                    self._masks_changed(output, had_masks)
+                elif kind == 'library_removed':
+                    for target in [output] + self._pending_outputs(name):
+                        target.remove_library_file(data.path)
+                    self._masks_changed(output, had_masks)
+                elif kind == 'library_rasters':
+                    if data == self._output_size(output):
+                        for target in [output] + self._pending_outputs(name):
+                            target.refresh_library_rasters()
+                        self._masks_changed(output, had_masks)
+            output_updates = [u for u in output_updates if u[0] in ('set', 'upsert', 'delete')]
+            masks = output.masks
+            last_set = max((i for i, (kind, _) in enumerate(output_updates) if kind == 'set'), default=None)
+            if last_set is not None:
+                masks = build_masks(output_updates[last_set][1], *self._output_size(output), fps=self.fps)
+                output_updates = output_updates[last_set + 1:]
+            # Из точечных обновлений одной фигуры важно только последнее
+            latest = {}
+            for kind, data in output_updates:
+                shape_id = data['id'] if kind == 'upsert' else data
+                latest.pop(shape_id, None)
+                latest[shape_id] = (kind, data)
+            if latest:
+                masks = [m for m in masks if m['id'] not in latest]
+                masks.extend(build_masks([data for kind, data in latest.values() if kind == 'upsert'],
+                                         *self._output_size(output), fps=self.fps))
+            if last_set is not None or latest:
+                output.masks = masks
+                self._masks_changed(output, had_masks)
 
     def load_video(self, video_path):
         self.video_path = video_path
@@ -86,101 +877,699 @@ class VideoMaskPlayer:
             return False
         self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        print(f"Видео загружено: {self.width}x{self.height}")
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and fps > 0 else 30.0
+        self._frame_index = 0
+        self._close_loop_cache()
+        frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if self.loop_cache_memory or self.loop_cache_disk:
+            # Запас на неточное число кадров в заголовке контейнера
+            self.loop_cache = loop_cache.LoopCache.create(
+                frame_count + 2, (self.height, self.width, 3),
+                self.loop_cache_memory, self.loop_cache_disk, self.loop_cache_dir)
+            if self.loop_cache is None:
+                print("Кэш цикла не помещается в бюджет, видео будет декодироваться каждый проход")
+            else:
+                where = "в памяти" if self.loop_cache.path is None else f"на диске ({self.loop_cache.path})"
+                print(f"Кэш цикла: {self.loop_cache.nbytes / loop_cache.MB:.0f} МБ {where}")
+        for output in self.outputs.values():
+            output.compiled_mask = None
+            output.time_quantum = 1.0 / self.fps
+            output.loop_steps = max(frame_count, 0)
+            output.mask_cache = MaskCache(loop_steps=output.loop_steps)
+        print(f"Видео загружено: {self.width}x{self.height} @ {self.fps:.2f} FPS")
         return True
 
-    def apply_all_masks(self, frame):
-        if not self.masks or not self.apply_mask:
+    def apply_all_masks(self, frame, out=None, output=mask_protocol.DEFAULT_OUTPUT, time=None):
+        """Накладывает маски выхода на момент time видео без коррекции перспективы."""
+        output = self.outputs[output]
+        if not output.all_masks or not self.apply_mask:
             return frame
-        combined_mask = np.zeros((self.height, self.width), dtype=np.uint8)
-        for mask_data in self.masks:
-            points = mask_data['points']
-            cv2.fillPoly(combined_mask, [points], 255)
-        return cv2.bitwise_and(frame, frame, mask=combined_mask)
+        height, width = frame.shape[:2]
+        return output.compiled(width, height, time).apply(frame, out=out, striped=output.striped)
+
+    def _render_slot(self, ring, index):
+        """Готовит кадры всех выходов из исходного кадра слота с масками его ролика."""
+        version = self.mask_version
+        raw = ring.raw[index]
+        time_ = ring.times[index]
+        outputs = self._clip_outputs.get(ring.clips[index], self.outputs)
+        started = self.metrics.start()
+        for name, output in outputs.items():
+            out = ring.output_view(name, index, *self._output_size(output))
+            ring.shown[name][index] = output.render(raw, out, self.apply_mask, time_)
+        self.metrics.stop('mask', started)
+        ring.stamps[index] = version
+
+    def _rasterize_shapes(self, shapes, width, height):
+        return CompiledMask.from_masks(build_masks(shapes, width, height, fps=self.fps), width, height).raster
+
+    def scan_mask_library(self):
+        """
+        Перечитывает изменившиеся файлы библиотеки и отправляет их в очередь масок.
+
+        Растры под размер выхода строятся здесь же, в вызывающем потоке, и
+        сохраняются в скомпилированную копию для следующего запуска.
+        """
+        changed, removed = self.mask_library.scan()
+        for mask_file in changed:
+            output = self.outputs.get(mask_file.output)
+            if output is None:
+                print(f"Библиотека масок: {mask_file.name} ссылается на неизвестный выход '{mask_file.output}'")
+                continue
+            self.mask_library.prepare(mask_file, [self._output_size(output)], self._rasterize_shapes)
+            self.mask_queue.put((mask_file.output, 'library', mask_file))
+        for mask_file in removed:
+            self.mask_queue.put((mask_file.output, 'library_removed', mask_file))
+        if changed or removed:
+            print(f"Библиотека масок: обновлено файлов {len(changed)}, удалено {len(removed)}")
+
+    def prepare_library_sizes(self):
+        """
+        Строит и сохраняет растры файлов библиотеки под новый размер обработки
+        выходов (см. check_output_sizes). До этого выход берёт растянутый
+        растр другого размера.
+        """
+        names = set()
+        while True:
+            try:
+                names.add(self._library_sizes.get_nowait())
+            except queue.Empty:
+                break
+        for name in names:
+            output = self.outputs.get(name)
+            if output is None:
+                continue
+            size = self._output_size(output)
+            files = [mask_file for mask_file in self.mask_library.files.values()
+                     if mask_file.output == name and not mask_file.animated and size not in mask_file.rasters]
+            for mask_file in files:
+                self.mask_library.prepare(mask_file, [size], self._rasterize_shapes)
+            if files:
+                self.mask_queue.put((name, 'library_rasters', size))
+
+    def _watch_mask_library(self):
+        """Фоновый поток: раз в library_interval секунд проверяет каталог библиотеки."""
+        while not self._stop_event.wait(self.library_interval):
+            try:
+                self.scan_mask_library()
+                self.prepare_library_sizes()
+            except OSError as e:
+                print(f"Библиотека масок: ошибка сканирования: {e}")
+
+    def request_skip(self, offset=1):
+        """Переключает плейлист на offset роликов вперёд (назад при отрицательном)."""
+        if len(self.playlist) < 2:
+            print("Плейлист не задан, переключать нечего")
+            return
+        # Само переключение делает поток декодирования перед следующим кадром
+        self._skip_request += offset
+
+    def _end_of_clip(self):
+        """Конец ролика: True, если плейлист переключился на следующий."""
+        if len(self.playlist) < 2:
+            return False
+        self._plays += 1
+        if self._plays < self.playlist[self.playlist_index].get('loops', 1):
+            return False
+        return self._switch_clip(1)
+
+    def _switch_clip(self, offset):
+        """Переключает поток декодирования на подготовленный ролик плейлиста."""
+        count = len(self.playlist)
+        step = 1 if offset >= 0 else -1
+        for _ in range(count):
+            index = (self.playlist_index + offset) % count
+            clip = self.prefetcher.take(index, self.playlist[index])
+            if clip is not None:
+                break
+            offset += step
+        else:
+            print("Плейлист: ни один ролик не открылся")
+            return False
+
+        self.cap.release()
+        if self._clip is not None:
+            self._clip.frames.clear()
+        self.cap = clip.cap
+        self.video_path = clip.item['video']
+        self.fps = clip.fps
+        self.playlist_index = clip.index
+        self._clip = clip
+        self._plays = 0
+        self._frame_index = 0
+        frame_count = max(int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+        for output in self.outputs.values():
+            output.time_quantum = 1.0 / self.fps
+            output.loop_steps = frame_count
+            output.mask_cache = MaskCache(loop_steps=frame_count)
+        pending = self._clip_outputs.get(self._clip_serial)
+        self._clip_serial += 1
+        if clip.shapes is None:
+            # Ролик без своих масок играет с масками предыдущего, даже если тот ещё не показан
+            if pending is not None:
+                self._clip_outputs[self._clip_serial] = pending
+        else:
+            # Маски ролика компилируются здесь, и его кадры сразу готовятся с ними;
+            # текущими выходами их сделает поток показа на первом кадре ролика
+            default = self.outputs[mask_protocol.DEFAULT_OUTPUT]
+            clip_output = default.with_masks(build_masks(clip.shapes, *self._output_size(default), fps=self.fps))
+            clip_output.compiled(*self._output_size(clip_output))
+            self._clip_outputs[self._clip_serial] = dict(self.outputs, **{default.name: clip_output})
+        next_index = (clip.index + 1) % count
+        self.prefetcher.start(next_index, self.playlist[next_index])
+        print(f"Плейлист: {clip.index + 1}/{count} {clip.name}")
+        return True
+
+    def _show_clip_masks(self, serial):
+        """
+        Первый кадр нового ролика или перемотки на экране: выходы с масками
+        ролика, подготовленные потоком декодирования, становятся текущими.
+
+        Кадры ролика уже готовы с этими масками, поэтому версия масок
+        меняется, только если маски пришлось включить.
+        """
+        outputs = self._clip_outputs.get(serial)
+        if outputs is not None:
+            for name, output in outputs.items():
+                current = self.outputs.get(name)
+                if current is None or current is output:
+                    continue
+                had_masks = bool(current.all_masks)
+                self.outputs[name] = output
+                print(f"Маски ролика установлены ({name}). Всего масок: {len(output.masks)}")
+                if not had_masks and output.all_masks and not self.apply_mask:
+                    self.apply_mask = True
+                    self.mask_version += 1
+        # Кадры более ранних переключений больше не покажутся
+        for stale in [s for s in list(self._clip_outputs) if s <= serial]:
+            self._clip_outputs.pop(stale, None)
+
+    def enable_striped(self, threads):
+        """Включает наложение масок полосами на threads потоках (0 или 1 - выключает)."""
+        if self.striped is not None:
+            self.striped.close()
+            self.striped = None
+        if threads and threads > 1:
+            import compositor
+            self.striped = compositor.StripedCompositor(threads)
+            print(f"Наложение масок полосами: потоков {threads}, "
+                  f"кадры от {self.striped.min_pixels} пикселей")
+        for output in self.outputs.values():
+            output.striped = self.striped
+
+    def _close_loop_cache(self):
+        if self.loop_cache is not None:
+            self.loop_cache.close()
+            self.loop_cache = None
+
+    def _seek(self, frame):
+        """Перематывает поток декодирования на кадр frame текущего ролика."""
+        if self._clip is not None:
+            # Заранее декодированное начало ролика больше не нужно
+            self._clip.frames.clear()
+        cache = self.loop_cache
+        if cache is not None and cache.complete:
+            frame %= cache.count
+        else:
+            if cache is not None:
+                print("Перемотка до конца первого прохода: кэш цикла отключён")
+                self._close_loop_cache()
+            count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            if count > 0:
+                frame = min(frame, count - 1)
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        self._frame_index = frame
+        # Новый номер для слотов буфера: кадры до перемотки поток показа выбросит.
+        # Маски ролика, чьи кадры ещё не показаны, переходят к новому номеру
+        clip_outputs = self._clip_outputs.pop(self._clip_serial, None)
+        self._clip_serial += 1
+        if clip_outputs is not None:
+            self._clip_outputs[self._clip_serial] = clip_outputs
+
+    def _read_frame(self, raw):
+        """
+        Читает следующий кадр в raw. False - конец файла, видео перемотано в начало.
+
+        Когда кэш цикла заполнен, кадр копируется из него без декодера и перемотки.
+        """
+        clip = self._clip
+        if clip is not None and clip.frames:
+            np.copyto(raw, clip.frames.popleft())
+            return True
+
+        cache = self.loop_cache
+        if cache is not None and cache.complete:
+            if self._frame_index >= cache.count:
+                self._frame_index = 0
+            np.copyto(raw, cache.frame(self._frame_index))
+            return True
+
+        ret, frame = self.cap.read(raw)
+        if not ret:
+            if self._end_of_clip():
+                return False
+            if cache is not None and cache.finish():
+                print(f"Кэш цикла заполнен ({cache.count} кадров), декодер больше не нужен")
+            else:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self._frame_index = 0
+            return False
+        if frame.ctypes.data != raw.ctypes.data:
+            # Декодер вернул кадр другого размера или формата
+            if frame.shape != raw.shape:
+                frame = cv2.resize(frame, (raw.shape[1], raw.shape[0]))
+            np.copyto(raw, frame)
+        if cache is not None and not cache.store(raw):
+            print("Ролик длиннее кэша цикла, возвращаемся к декодированию каждого прохода")
+            self._close_loop_cache()
+        return True
+
+    def _decode_loop(self, ring):
+        """Поток декодирования: читает кадры, накладывает маски и пишет их в буфер."""
+        while not self._stop_event.is_set():
+            index = ring.reserve(timeout=0.1)
+            if index is None:
+                continue
+            if self._skip_request:
+                offset, self._skip_request = self._skip_request, 0
+                self._switch_clip(offset)
+            if self._seek_request is not None:
+                frame, self._seek_request = self._seek_request, None
+                self._seek(frame)
+            raw = ring.raw[index]
+            started = self.metrics.start()
+            ret = self._read_frame(raw)
+            self.metrics.stop('decode', started)
+            if not ret:
+                continue
+            ring.times[index] = self._frame_index / self.fps
+            ring.clips[index] = self._clip_serial
+            self._frame_index += 1
+            self._publish_preview(raw)
+            self._render_slot(ring, index)
+            ring.commit()
+
+    def _publish_preview(self, frame):
+        """Пишет уменьшенный кадр в разделяемую память не чаще preview_rate раз в секунду."""
+        if self.preview is None:
+            return
+        now = time.perf_counter()
+        if now - self._last_preview < 1.0 / self.preview_rate:
+            return
+        self._last_preview = now
+        self.preview.begin()
+        cv2.resize(frame, self.preview.size, dst=self.preview.image, interpolation=cv2.INTER_LINEAR)
+        self.preview.commit()
+
+    def _report_stats(self):
+        print(f"Кадров показано: {self.stats['presented']}, "
+              f"пропущено: {self.stats['dropped']}, повторено: {self.stats['repeated']}")
 
     def toggle_mask(self):
         self.apply_mask = not self.apply_mask
+        self.mask_version += 1
         status = "ВКЛ" if self.apply_mask else "ВЫКЛ"
         print(f"Все маски: {status}")
         
     def toggle_fullscreen(self):
-        """Переключение полноэкранного режима"""
+        """Переключение полноэкранного режима всех окон выходов"""
         self.is_fullscreen = not self.is_fullscreen
         
-        if self.is_fullscreen:
-            cv2.setWindowProperty('Video Mask Player', cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
-            print("Полноэкранный режим ВКЛ")
-        else:
-            cv2.setWindowProperty('Video Mask Player', cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_NORMAL)
-            cv2.resizeWindow('Video Mask Player', 1200, 800)
-            print("Полноэкранный режим ВЫКЛ")
+        for output in self.outputs.values():
+            if self.is_fullscreen:
+                cv2.setWindowProperty(output.window, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+            else:
+                cv2.setWindowProperty(output.window, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_NORMAL)
+                cv2.resizeWindow(output.window, 1200, 800)
+        # Размер окна меняется асинхронно, проверяем его на ближайших кадрах
+        self._next_size_check = 0.0
+        print(f"Полноэкранный режим {'ВКЛ' if self.is_fullscreen else 'ВЫКЛ'}")
+
+    def check_output_sizes(self):
+        """
+        Подстраивает размер обработки выходов под их окна.
+
+        Маска перекомпилируется только при смене размера; слоты, готовые со
+        старым размером, переготавливаются при показе по версии масок.
+        """
+        if not self.adaptive_resolution:
+            return
+        changed = False
+        for output in self.outputs.values():
+            try:
+                _, _, window_width, window_height = cv2.getWindowImageRect(output.window)
+            except cv2.error:
+                continue
+            if output.fit_display(self.width, self.height, window_width, window_height):
+                out_w, out_h = self._output_size(output)
+                print(f"Выход {output.name}: обработка в {out_w}x{out_h}")
+                output.compiled(out_w, out_h)
+                for pending in self._pending_outputs(output.name):
+                    pending.display_size = output.display_size
+                if self.mask_library is not None:
+                    self._library_sizes.put(output.name)
+                changed = True
+        if changed:
+            self.mask_version += 1
+
+    def _startup_done(self):
+        """Первый кадр на экране: отчёт о запуске и запуск скрытого редактора"""
+        startup.mark("первый кадр на экране")
+        if self.startup_report:
+            startup.report("Плеер")
+        if self.editor.prewarm and not self.editor.running:
+            # Только после первого кадра, чтобы импорт Qt в редакторе не замедлял запуск плеера
+            self.editor.start()
 
     def run(self):
         if not self.cap:
             print("Ошибка: Видео не загружено")
             return
 
-        server_thread = threading.Thread(target=self._start_socket_server, daemon=True)
-        server_thread.start()
+        # Маски и команды клиентов принимает сервер на asyncio в своём потоке
+        self.server = control_server.ControlServer(self)
+        self.server.start()
+
+        output_shapes = {}
+        for name, output in self.outputs.items():
+            out_w, out_h = output.max_frame_size(self.width, self.height)
+            output_shapes[name] = (out_h, out_w, 3)
+        ring = FrameRingBuffer(self.ring_capacity, (self.height, self.width, 3), output_shapes)
+        if self.preview_rate > 0:
+            preview_height = max(1, round(self.height * self.preview_width / self.width))
+            try:
+                self.preview = frame_preview.PreviewPublisher(self.preview_width, preview_height)
+            except OSError as e:
+                print(f"Превью для редактора недоступно: {e}")
+        self._stop_event.clear()
+        self.enable_striped(self.composite_threads)
+        if self.mask_library_dir:
+            # Первое чтение - до первого кадра, дальше изменения подхватывает фоновый поток
+            self.mask_library = mask_library.MaskLibrary(self.mask_library_dir)
+            self.scan_mask_library()
+            self.check_for_new_masks()
+            threading.Thread(target=self._watch_mask_library, daemon=True).start()
+        if len(self.playlist) > 1:
+            self.prefetcher = playlist.ClipPrefetcher((self.width, self.height), self.prefetch_frames,
+                                                      load_shapes_file)
+            next_index = (self.playlist_index + 1) % len(self.playlist)
+            self.prefetcher.start(next_index, self.playlist[next_index])
+        decode_thread = threading.Thread(target=self._decode_loop, args=(ring,), daemon=True)
+        decode_thread.start()
 
-        cv2.namedWindow('Video Mask Player', cv2.WINDOW_NORMAL)
-        cv2.resizeWindow('Video Mask Player', 1200, 800)
+        for output in self.outputs.values():
+            cv2.namedWindow(output.window, cv2.WINDOW_NORMAL)
+            cv2.resizeWindow(output.window, 1200, 800)
+        startup.mark("окна созданы")
         
         print("\n=== УПРАВЛЕНИЕ ===")
         print("SPACE - Пауза/Продолжить")
         print("M - Вкл/Выкл маску")
         print("E - Открыть редактор масок")
+        print("O - Оверлей с временем стадий кадра")
+        if len(self.playlist) > 1:
+            print("N / P - Следующий / предыдущий ролик плейлиста")
         print("Q - Выход")
         print("==================\n")
 
-        editor_process = None
+        startup_pending = True  # Первый кадр ещё не показан
+        fresh_serial = 0  # Слоты с меньшим номером декодированы до перемотки
+        present_next = False  # Показать один кадр и на паузе (после перемотки)
+        next_due = time.perf_counter()
+        last_report = next_due
+        reported = (0, 0)
+        has_frame = False  # Удерживает ли показ текущий слот буфера
+
+        exporter = None
+        if self.metrics_file or self.metrics_port:
+            exporter = metrics.MetricsExporter(self.metrics, self.metrics_file, self.metrics_port,
+                                               self.metrics_interval, frame_stats=self.stats)
+        self.metrics.enabled = self.show_overlay or exporter is not None
+        overlay_summary = {}
+        overlay_frame = None  # Копия кадра, на которой рисуется оверлей
+        last_summary = 0.0
+        last_present = None
+        last_shown = None
 
         while True:
             # Проверяем, не пришли ли новые маски
+            started = self.metrics.start()
             self.check_for_new_masks()
+            self.metrics.stop('queue', started)
 
-            if self.is_playing:
-                ret, frame = self.cap.read()
-                if not ret:
-                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                    continue
-            
-            if 'frame' in locals():
-                display_frame = frame.copy()
-                if self.apply_mask and self.masks:
-                    display_frame = self.apply_all_masks(display_frame)
-                
-                cv2.imshow('Video Mask Player', display_frame)
-            
-            key = cv2.waitKey(1) & 0xFF
+            while not has_frame and ring.ready() and ring.clips[ring.slot()] < fresh_serial:
+                ring.release()
+
+            now = time.perf_counter()
+            period = 1.0 / self.fps  # Ролики плейлиста могут иметь разную частоту кадров
+            if (self.is_playing or present_next) and now >= next_due:
+                # Текущий слот удерживается, поэтому следующий кадр - второй в буфере
+                needed = 2 if has_frame else 1
+                if ring.ready() >= needed:
+                    if has_frame:
+                        ring.release()
+                    next_due += period
+                    # Сильно отстали от расписания - пропускаем готовые кадры
+                    while now - next_due >= period and ring.ready() >= 2:
+                        ring.release()
+                        self.stats['dropped'] += 1
+                        next_due += period
+                    has_frame = True
+                    present_next = False
+                    self.stats['presented'] += 1
+                    show_slot = True
+                else:
+                    if has_frame:
+                        self.stats['repeated'] += 1
+                    next_due += period
+                    show_slot = False
+                if now - next_due >= period:
+                    # Догнать не получится, начинаем расписание заново
+                    next_due = now + period
+            else:
+                show_slot = False
+
+            if now >= self._next_size_check:
+                self._next_size_check = now + 0.25
+                self.check_output_sizes()
+                if self.preview is not None:
+                    # Редактор отличает паузу от перезапуска плеера по пульсу превью
+                    self.preview.heartbeat()
+
+            if has_frame:
+                index = ring.slot()
+                if ring.clips[index] != self._shown_clip:
+                    self._shown_clip = ring.clips[index]
+                    self._show_clip_masks(self._shown_clip)
+                if ring.stamps[index] != self.mask_version:
+                    # Маски сменились после подготовки кадра - переналожим их здесь
+                    self._render_slot(ring, index)
+                    show_slot = True
+                if show_slot:
+                    started = self.metrics.start()
+                    for name, output in self.outputs.items():
+                        frame = ring.shown[name][index]
+                        if self.show_overlay and name == mask_protocol.DEFAULT_OUTPUT:
+                            if now - last_summary >= 0.5:
+                                last_summary = now
+                                overlay_summary = self.metrics.summary()
+                            # Рисуем в копию: кадр выхода может быть самим исходным кадром слота,
+                            # общим для всех выходов и нужным для повторной подготовки
+                            if overlay_frame is None or overlay_frame.shape != frame.shape:
+                                overlay_frame = np.empty_like(frame)
+                            np.copyto(overlay_frame, frame)
+                            frame = overlay_frame
+                            self.metrics.draw_overlay(frame, overlay_summary)
+                        cv2.imshow(output.window, frame)
+                    self.metrics.stop('present', started)
+                    if ring.times[index] != self.shown_time:
+                        # Частота показа новых кадров; повторный показ с новыми масками не считается
+                        presented_at = time.perf_counter()
+                        if last_shown is not None:
+                            rate = 1.0 / max(presented_at - last_shown, 1e-6)
+                            self.display_fps = 0.9 * self.display_fps + 0.1 * rate if self.display_fps else rate
+                        last_shown = presented_at
+                        self.shown_time = ring.times[index]
+                    if started is not None:
+                        if last_present is not None:
+                            self.metrics.record('interval', started - last_present)
+                        last_present = started
+
+            if now - last_report >= 5.0:
+                last_report = now
+                current = (self.stats['dropped'], self.stats['repeated'])
+                if current != reported:
+                    reported = current
+                    self._report_stats()
+
+            if exporter is not None:
+                exporter.maybe_dump()
+
+            delay = max(1, int((next_due - time.perf_counter()) * 1000))
+            started = self.metrics.start()
+            key = cv2.waitKey(delay if self.is_playing else 30) & 0xFF
+            self.metrics.stop('wait', started)
+            if startup_pending and last_shown is not None:
+                # waitKey уже отрисовал первый кадр
+                startup_pending = False
+                self._startup_done()
 
             if key == ord('q'):
                 break
             elif key == ord(' '):
                 self.is_playing = not self.is_playing
+                next_due = time.perf_counter()
             elif key == ord('m'):
                 self.toggle_mask()
             elif key == ord('f'): # <-- Вот исправленная строка
                 self.toggle_fullscreen()
+            elif key == ord('n'):
+                self.request_skip(1)
+            elif key == ord('p'):
+                self.request_skip(-1)
+            elif key == ord('o'):
+                self.show_overlay = not self.show_overlay
+                self.metrics.enabled = self.show_overlay or exporter is not None
+                last_summary = 0.0
+                # Интервал до показа, бывшего ещё при выключенном сборе, не считаем
+                last_present = None
             elif key == ord('e'):
-                # Запускаем редактор как совершенно отдельный процесс
-                if editor_process is None or editor_process.poll() is not None:
-                    print("Запускаем редактор масок...")
-                    editor_process = subprocess.Popen([sys.executable, 'shape_editor.py'])
+                # Редактор - совершенно отдельный процесс
+                self.editor.show()
+
+            for command, value in self._take_controls():
+                if command == 'seek':
+                    # Кадры в буфере устарели: отпускаем их все, перематывает поток декодирования
+                    self._seek_request = value
+                    fresh_serial = self._clip_serial + 1
+                    for _ in range(ring.ready()):
+                        ring.release()
+                    has_frame = False
+                    present_next = True
+                    next_due = time.perf_counter()
+                elif command == 'toggle_mask':
+                    self.toggle_mask()
                 else:
-                    print("Редактор уже запущен.")
-        
+                    playing = not self.is_playing if command == 'toggle_play' else command == 'play'
+                    if playing != self.is_playing:
+                        self.is_playing = playing
+                        next_due = time.perf_counter()
+
+        self._stop_event.set()
+        self.server.close()
+        ring.close()
+        decode_thread.join()
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+        self.enable_striped(0)
+        self.editor.close()
+        if exporter is not None:
+            exporter.close()
+        if self.preview is not None:
+            self.preview.close()
+            self.preview = None
+        self._report_stats()
+        self._close_loop_cache()
         self.cap.release()
         cv2.destroyAllWindows()
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Видеоплеер с масками для проектора")
+    parser.add_argument('video', nargs='?', default="2.mov", help="Путь к видео файлу")
+    parser.add_argument('--playlist', metavar='JSON',
+                        help="Плейлист: ролики со своими масками, играют по очереди")
+    parser.add_argument('--prefetch-frames', type=int, default=12,
+                        help="Сколько первых кадров следующего ролика плейлиста декодировать заранее")
+    parser.add_argument('--render', metavar='OUTPUT',
+                        help="Без окна запечь маски в видео OUTPUT (нужен --masks)")
+    parser.add_argument('--masks', metavar='JSON',
+                        help="Файл масок, сохранённый редактором (для --render или начальные маски плеера)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Число процессов для --render (по умолчанию - все ядра)")
+    parser.add_argument('--fourcc', default='mp4v', help="Кодек выходного видео для --render")
+    parser.add_argument('--outputs', metavar='JSON',
+                        help="Описание выходов: имена, размеры и углы коррекции перспективы")
+    parser.add_argument('--mask-library', metavar='DIR',
+                        help="Каталог JSON файлов масок: загружается при запуске и перечитывается при изменении")
+    parser.add_argument('--library-interval', type=float, default=1.0,
+                        help="Период проверки каталога --mask-library, секунды")
+    parser.add_argument('--loop-cache-mb', type=int, default=0,
+                        help="Бюджет памяти на кэш декодированных кадров для бесшовного цикла, МБ (0 - выключен)")
+    parser.add_argument('--loop-cache-disk-mb', type=int, default=0,
+                        help="Если ролик не влез в память - бюджет на кэш в файле на диске, МБ")
+    parser.add_argument('--loop-cache-dir', metavar='DIR',
+                        help="Каталог для файла кэша цикла (по умолчанию - временный)")
+    parser.add_argument('--composite-threads', type=int, default=0,
+                        help="Накладывать маски на больших кадрах полосами на N потоках (0 - один поток)")
+    parser.add_argument('--full-resolution', action='store_true',
+                        help="Накладывать маски в разрешении видео, а не в размере окна")
+    parser.add_argument('--preview-rate', type=float, default=10.0,
+                        help="Частота превью кадра для редактора, Гц (0 - выключить)")
+    parser.add_argument('--metrics-file', metavar='PATH',
+                        help="Периодически писать перцентили стадий кадра (.csv или текст Prometheus)")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="Отдавать метрики Prometheus на http://localhost:PORT/metrics")
+    parser.add_argument('--metrics-interval', type=float, default=5.0,
+                        help="Период записи --metrics-file, секунды")
+    parser.add_argument('--prewarm-editor', action='store_true',
+                        help="Держать редактор масок запущенным в скрытом окне: E показывает его сразу")
+    parser.add_argument('--startup-report', action='store_true',
+                        help="Напечатать время этапов запуска плеера (и редактора, запущенного из него)")
+    return parser.parse_args(argv)
+
+
 def main():
-    app = QApplication(sys.argv) 
-    player = VideoMaskPlayer(app)
+    args = parse_args()
+    video_path = args.video
+
+    if args.render:
+        if not args.masks:
+            print("Ошибка: для --render нужен файл масок --masks")
+            return
+        import batch_render
+        batch_render.render_video(video_path, args.masks, args.render,
+                                  workers=args.workers, fourcc=args.fourcc)
+        return
+
+    player = VideoMaskPlayer()
+    player.startup_report = args.startup_report
+    player.editor = editor_process.EditorProcess(
+        prewarm=args.prewarm_editor, args=['--startup-report'] if args.startup_report else [])
+    player.preview_rate = args.preview_rate
+    player.metrics_file = args.metrics_file
+    player.metrics_port = args.metrics_port
+    player.metrics_interval = args.metrics_interval
+    player.loop_cache_memory = args.loop_cache_mb * loop_cache.MB
+    player.loop_cache_disk = args.loop_cache_disk_mb * loop_cache.MB
+    player.loop_cache_dir = args.loop_cache_dir
+    player.mask_library_dir = args.mask_library
+    player.library_interval = args.library_interval
+    player.prefetch_frames = args.prefetch_frames
+    player.adaptive_resolution = not args.full_resolution
+    player.composite_threads = args.composite_threads
+
+    first_masks = None
+    if args.playlist:
+        player.playlist = playlist.load_playlist(args.playlist)
+        if not player.playlist:
+            print("Ошибка: плейлист пуст")
+            return
+        video_path = player.playlist[0]['video']
+        first_masks = player.playlist[0].get('masks')
+        if len(player.playlist) > 1 and (player.loop_cache_memory or player.loop_cache_disk):
+            print("Кэш цикла в режиме плейлиста не используется")
+            player.loop_cache_memory = player.loop_cache_disk = 0
+    if args.outputs:
+        player.configure_outputs(load_outputs_file(args.outputs))
     
-    video_path = "2.mov"
     if not os.path.exists(video_path) or not player.load_video(video_path):
         print("Основное видео не найдено. Пожалуйста, проверьте путь.")
         return
+    startup.mark("видео открыто")
+    if args.masks or first_masks:
+        player.set_mask_from_editor(load_shapes_file(first_masks or args.masks))
 
     player.run()
 
@@ -0,0 +1,203 @@
+"""
+Библиотека масок на диске.
+
+Каталог с JSON файлами, сохранёнными редактором (CanvasWidget.save_to_json).
+Плеер читает его при запуске и затем следит за изменениями: перечитываются
+только файлы, у которых сменились время изменения или размер.
+
+Рядом с каждым файлом в подкаталоге SIDECAR_DIR хранится скомпилированная
+копия (.npz): точки всех фигур одним массивом float32 и битовые растры
+объединённой маски для последних MAX_RASTERS разрешений. Пока JSON не
+менялся, холодный старт берёт фигуры и растры из неё, без разбора JSON и
+заливки полигонов. Файлы с ключевыми кадрами хранятся только как JSON:
+их растр зависит от времени.
+"""
+import glob
+import json
+import os
+
+import numpy as np
+
+from mask_protocol import DEFAULT_OUTPUT
+
+SIDECAR_DIR = '.compiled'
+SIDECAR_VERSION = 1
+MAX_RASTERS = 4  # Разрешений на файл: окно меняет размер, старые растры вытесняются
+
+
+class MaskFile:
+    """Фигуры одного файла библиотеки и упакованные растры по разрешениям"""
+
+    def __init__(self, path, mtime_ns, size, shapes, output=DEFAULT_OUTPUT, rasters=None):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.shapes = shapes  # [{'id', 'points' float32 N x 2, 'is_closed', ['keyframes']}]
+        self.output = output  # Выход плеера, ключ "output" в JSON
+        self.rasters = rasters or {}  # (ширина, высота) -> np.packbits растра
+        self.animated = any(shape.get('keyframes') for shape in shapes)
+        self.dirty = False  # Скомпилированную копию нужно перезаписать
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    @property
+    def sidecar_path(self):
+        return os.path.join(os.path.dirname(self.path), SIDECAR_DIR, self.name + '.npz')
+
+    def raster(self, width, height):
+        """Растр 0/255 для разрешения или None, если он ещё не построен"""
+        packed = self.rasters.get((width, height))
+        if packed is None:
+            return None
+        bits = np.unpackbits(packed, count=width * height).reshape(height, width)
+        return np.multiply(bits, 255, out=bits)
+
+    def scaled_raster(self, width, height):
+        """
+        Наибольший готовый растр, растянутый до размера по ближайшему пикселю,
+        или None. Замена на время, пока точный растр строится в фоне.
+        """
+        sizes = list(self.rasters)  # Поток библиотеки может добавлять растры одновременно
+        if not sizes:
+            return None
+        src_w, src_h = max(sizes, key=lambda size: size[0] * size[1])
+        source = self.raster(src_w, src_h)
+        if source is None:
+            return None
+        rows = np.arange(height) * src_h // height
+        cols = np.arange(width) * src_w // width
+        return np.ascontiguousarray(source[rows[:, None], cols])
+
+    def add_raster(self, width, height, raster):
+        while len(self.rasters) >= MAX_RASTERS:
+            self.rasters.pop(next(iter(self.rasters)))
+        self.rasters[(width, height)] = np.packbits(raster > 0)
+        self.dirty = True
+
+    def save_sidecar(self):
+        """Пишет скомпилированную копию атомарно, через временный файл"""
+        if self.animated:
+            return
+        counts = np.array([len(shape['points']) for shape in self.shapes], dtype=np.int64)
+        points = (np.concatenate([shape['points'] for shape in self.shapes])
+                  if self.shapes else np.empty((0, 2), dtype=np.float32))
+        arrays = {
+            'version': np.int64(SIDECAR_VERSION),
+            'mtime_ns': np.int64(self.mtime_ns),
+            'size': np.int64(self.size),
+            'output': np.str_(self.output),
+            'ids': np.array([shape['id'] for shape in self.shapes], dtype=np.int64),
+            'counts': counts,
+            'points': points.astype(np.float32),
+        }
+        for (width, height), packed in self.rasters.items():
+            arrays[f'raster_{width}x{height}'] = packed
+
+        path = self.sidecar_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path, stat):
+        """Читает файл: из скомпилированной копии, если она свежая, иначе из JSON"""
+        mask_file = cls._load_sidecar(path, stat)
+        if mask_file is not None:
+            return mask_file
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        output = DEFAULT_OUTPUT
+        if isinstance(data, dict):
+            output = data.get('output', DEFAULT_OUTPUT)
+            data = data.get('shapes', [])
+        shapes = []
+        for i, shape_data in enumerate(data):
+            if not shape_data.get('is_closed'):
+                continue
+            shape = {'id': shape_data.get('id', i), 'is_closed': True,
+                     'points': np.asarray(shape_data['points'], dtype=np.float32).reshape(-1, 2)}
+            if shape_data.get('keyframes'):
+                shape['keyframes'] = shape_data['keyframes']
+            shapes.append(shape)
+        mask_file = cls(path, stat.st_mtime_ns, stat.st_size, shapes, output)
+        mask_file.dirty = True
+        return mask_file
+
+    @classmethod
+    def _load_sidecar(cls, path, stat):
+        sidecar = os.path.join(os.path.dirname(path), SIDECAR_DIR, os.path.basename(path) + '.npz')
+        try:
+            with np.load(sidecar, allow_pickle=False) as data:
+                if (int(data['version']) != SIDECAR_VERSION or int(data['mtime_ns']) != stat.st_mtime_ns
+                        or int(data['size']) != stat.st_size):
+                    return None
+                counts = data['counts']
+                chunks = np.split(data['points'], np.cumsum(counts)[:-1]) if len(counts) else []
+                shapes = [{'id': int(shape_id), 'points': points, 'is_closed': True}
+                          for shape_id, points in zip(data['ids'], chunks)]
+                rasters = {}
+                for key in data.files:
+                    if key.startswith('raster_'):
+                        width, height = map(int, key[len('raster_'):].split('x'))
+                        rasters[(width, height)] = data[key]
+                return cls(path, stat.st_mtime_ns, stat.st_size, shapes, str(data['output']), rasters)
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+class MaskLibrary:
+    """Каталог файлов масок с отслеживанием изменений по mtime"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}  # путь -> MaskFile
+
+    def scan(self):
+        """
+        Перечитывает изменившиеся файлы.
+
+        Возвращает (новые или изменённые MaskFile, удалённые MaskFile).
+        Файл, который не удалось разобрать (например, ещё дописывается),
+        пропускается до следующего сканирования, прежняя версия остаётся.
+        """
+        paths = set(glob.glob(os.path.join(self.directory, '*.json')))
+        removed = [self.files.pop(path) for path in list(self.files) if path not in paths]
+        changed = []
+        for path in sorted(paths):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            known = self.files.get(path)
+            if known is not None and known.mtime_ns == stat.st_mtime_ns and known.size == stat.st_size:
+                continue
+            try:
+                mask_file = MaskFile.load(path, stat)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"Библиотека масок: не удалось прочитать {os.path.basename(path)}: {e}")
+                continue
+            self.files[path] = mask_file
+            changed.append(mask_file)
+        return changed, removed
+
+    def prepare(self, mask_file, sizes, rasterize):
+        """
+        Достраивает растры для разрешений sizes и сохраняет скомпилированную копию.
+
+        rasterize(фигуры, ширина, высота) -> растр uint8 0/255.
+        """
+        if mask_file.animated:
+            return
+        for width, height in sizes:
+            if (width, height) not in mask_file.rasters:
+                mask_file.add_raster(width, height, rasterize(mask_file.shapes, width, height))
+        if mask_file.dirty:
+            try:
+                mask_file.save_sidecar()
+            except OSError as e:
+                print(f"Библиотека масок: не удалось сохранить {mask_file.sidecar_path}: {e}")
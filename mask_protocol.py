@@ -0,0 +1,310 @@
+"""
+Бинарный протокол обновления масок между редактором и плеером.
+
+Сообщения идут по одному постоянному TCP соединению. Каждое сообщение -
+заголовок HEADER (магия, версия протокола, тип, длина полезной нагрузки)
+и сама нагрузка. Точки фигур передаются упакованными float32 (x, y в
+диапазоне 0..1), поэтому читаются в NumPy без обработки каждой точки.
+
+Команды управления и запросы состояния (MSG_COMMAND) редки и
+расширяемы, поэтому их нагрузка - JSON. Только на них плеер отвечает
+(MSG_REPLY), обновления масок остаются односторонними.
+"""
+import json
+import socket
+import struct
+
+import numpy as np
+
+HOST, PORT = "localhost", 12345
+
+MAGIC = b'TROM'
+VERSION = 1
+HEADER = struct.Struct('<4sBBI')        # магия, версия, тип, длина нагрузки
+SHAPE_HEADER = struct.Struct('<IBxxxI')  # id фигуры, флаги, число точек
+COUNT = struct.Struct('<I')
+OFFSET = struct.Struct('<i')
+
+MSG_SET = 1     # Полный набор фигур, заменяет текущий
+MSG_UPSERT = 2  # Добавить или заменить одну фигуру по id
+MSG_DELETE = 3  # Удалить одну фигуру по id
+MSG_TARGET = 4  # Выбрать выход плеера для следующих сообщений этого соединения
+MSG_CALIBRATE = 5  # Коррекция перспективы выхода: 4 угла кадра (x, y) в 0..1
+MSG_SKIP = 6    # Переключить плейлист на N роликов вперёд (назад при N < 0)
+MSG_COMMAND = 7  # Команда или запрос управления: JSON {"cmd": ..., "id": ...}
+MSG_REPLY = 8    # Ответ плеера на MSG_COMMAND: JSON {"id", "ok", ...}
+
+DEFAULT_OUTPUT = "main"
+
+REPLY_TIMEOUT = 3.0  # Сколько секунд клиент ждёт ответа плеера
+MAX_PAYLOAD = 64 * 1024 * 1024  # Больше - заведомо испорченный заголовок, а не набор фигур
+
+FLAG_CLOSED = 1
+
+POINT_DTYPE = np.dtype('<f4')
+
+
+class ProtocolError(Exception):
+    """Некорректное или неподдерживаемое сообщение."""
+
+
+def _encode_shape(shape):
+    points = np.ascontiguousarray(shape['points'], dtype=POINT_DTYPE).reshape(-1, 2)
+    flags = FLAG_CLOSED if shape.get('is_closed', True) else 0
+    return SHAPE_HEADER.pack(shape['id'], flags, len(points)) + points.tobytes()
+
+
+def _frame(msg_type, payload):
+    return HEADER.pack(MAGIC, VERSION, msg_type, len(payload)) + payload
+
+
+def encode_set(shapes):
+    """Кодирует полный набор фигур: [{'id', 'points', 'is_closed'}, ...]."""
+    parts = [COUNT.pack(len(shapes))]
+    parts.extend(_encode_shape(shape) for shape in shapes)
+    return _frame(MSG_SET, b''.join(parts))
+
+
+def encode_upsert(shape):
+    return _frame(MSG_UPSERT, _encode_shape(shape))
+
+
+def encode_delete(shape_id):
+    return _frame(MSG_DELETE, COUNT.pack(shape_id))
+
+
+def encode_target(output):
+    return _frame(MSG_TARGET, output.encode('utf-8'))
+
+
+def encode_calibration(corners):
+    corners = np.ascontiguousarray(corners, dtype=POINT_DTYPE).reshape(4, 2)
+    return _frame(MSG_CALIBRATE, corners.tobytes())
+
+
+def encode_skip(offset=1):
+    return _frame(MSG_SKIP, OFFSET.pack(offset))
+
+
+def encode_command(command):
+    """Кодирует команду управления: {'cmd': 'ping' | 'status' | 'play' | 'seek' ..., параметры}"""
+    return _frame(MSG_COMMAND, json.dumps(command, ensure_ascii=False).encode('utf-8'))
+
+
+def encode_reply(reply):
+    return _frame(MSG_REPLY, json.dumps(reply, ensure_ascii=False).encode('utf-8'))
+
+
+def _decode_shape(payload, offset):
+    shape_id, flags, count = SHAPE_HEADER.unpack_from(payload, offset)
+    offset += SHAPE_HEADER.size
+    end = offset + count * 2 * POINT_DTYPE.itemsize
+    if end > len(payload):
+        raise ProtocolError("Обрезанный массив точек")
+    points = np.frombuffer(payload, dtype=POINT_DTYPE, count=count * 2, offset=offset).reshape(-1, 2)
+    shape = {'id': shape_id, 'points': points, 'is_closed': bool(flags & FLAG_CLOSED)}
+    return shape, end
+
+
+def decode_message(msg_type, payload):
+    """
+    Разбирает нагрузку сообщения.
+
+    Возвращает ('set', [фигуры]), ('upsert', фигура), ('delete', id),
+    ('target', имя выхода), ('calibrate', углы 4 x 2), ('skip', сдвиг),
+    ('command', словарь) или ('reply', словарь).
+    """
+    try:
+        if msg_type == MSG_SET:
+            (count,) = COUNT.unpack_from(payload, 0)
+            offset = COUNT.size
+            shapes = []
+            for _ in range(count):
+                shape, offset = _decode_shape(payload, offset)
+                shapes.append(shape)
+            return 'set', shapes
+        if msg_type == MSG_UPSERT:
+            return 'upsert', _decode_shape(payload, 0)[0]
+        if msg_type == MSG_DELETE:
+            return 'delete', COUNT.unpack_from(payload, 0)[0]
+        if msg_type == MSG_TARGET:
+            return 'target', bytes(payload).decode('utf-8')
+        if msg_type == MSG_CALIBRATE:
+            if len(payload) != 8 * POINT_DTYPE.itemsize:
+                raise ProtocolError("Калибровка должна содержать 4 точки")
+            return 'calibrate', np.frombuffer(payload, dtype=POINT_DTYPE).reshape(4, 2)
+        if msg_type == MSG_SKIP:
+            return 'skip', OFFSET.unpack_from(payload, 0)[0]
+        if msg_type in (MSG_COMMAND, MSG_REPLY):
+            data = json.loads(bytes(payload).decode('utf-8'))
+            if not isinstance(data, dict):
+                raise ProtocolError("Команда должна быть JSON объектом")
+            return ('command' if msg_type == MSG_COMMAND else 'reply'), data
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ProtocolError(f"Обрезанное сообщение: {e}") from e
+    except json.JSONDecodeError as e:
+        raise ProtocolError(f"Некорректный JSON команды: {e}") from e
+    raise ProtocolError(f"Неизвестный тип сообщения: {msg_type}")
+
+
+def recv_exact(sock, size, buffer=None):
+    """Читает ровно size байт. Возвращает None, если соединение закрыто раньше."""
+    if buffer is None:
+        buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:size])
+        if n == 0:
+            return None
+        received += n
+    return buffer
+
+
+def parse_header(header):
+    """Проверяет заголовок сообщения, возвращает (тип, длина нагрузки)"""
+    magic, version, msg_type, length = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError("Неверная сигнатура сообщения")
+    if version != VERSION:
+        raise ProtocolError(f"Неподдерживаемая версия протокола: {version}")
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"Слишком длинное сообщение: {length} байт")
+    return msg_type, length
+
+
+def read_message(sock, header=None):
+    """
+    Читает одно сообщение. Возвращает (тип, нагрузка) или None при закрытии.
+
+    header - уже прочитанные байты заголовка, если они есть.
+    """
+    if header is None:
+        header = recv_exact(sock, HEADER.size)
+        if header is None:
+            return None
+    msg_type, length = parse_header(header)
+    payload = recv_exact(sock, length)
+    if payload is None:
+        return None
+    return msg_type, payload
+
+
+class MaskClient:
+    """Постоянное соединение редактора с плеером, переподключается при обрыве."""
+
+    def __init__(self, host=HOST, port=PORT, output=DEFAULT_OUTPUT):
+        self.host = host
+        self.port = port
+        self.output = output
+        self.sock = None
+        self._request_id = 0
+        self.connections = 0  # Сколько раз открывалось соединение: по смене видно переподключение
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.host, self.port))
+        self.connections += 1
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.output != DEFAULT_OUTPUT:
+            # Выбор выхода - состояние соединения, после переподключения его нужно повторить
+            self.sock.sendall(encode_target(self.output))
+
+    def select_output(self, output):
+        """Направляет следующие сообщения в выход плеера с этим именем"""
+        self.output = output
+        if self.sock is not None:
+            self.send(encode_target(output))
+
+    def _alive(self):
+        """
+        Не закрыл ли плеер соединение, пока оно простаивало.
+
+        После перезапуска плеера sendall в старое соединение ещё проходит в
+        буфер ядра, а сообщение теряется, поэтому конец потока или сброс
+        проверяем до отправки.
+        """
+        self.sock.setblocking(False)
+        try:
+            return self.sock.recv(1, socket.MSG_PEEK) != b''
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        finally:
+            self.sock.setblocking(True)
+
+    def send(self, data):
+        """Отправляет готовое сообщение, при обрыве соединения - одна повторная попытка."""
+        if self.sock is not None and not self._alive():
+            self.close()
+        for attempt in range(2):
+            if self.sock is None:
+                self._connect()
+            try:
+                self.sock.sendall(data)
+                return
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+
+    def send_set(self, shapes, confirm=False):
+        """confirm - дождаться подтверждения, что плеер получил набор (см. confirm)"""
+        self.send(encode_set(shapes))
+        if confirm:
+            self.confirm()
+
+    def send_upsert(self, shape):
+        self.send(encode_upsert(shape))
+
+    def send_delete(self, shape_id):
+        self.send(encode_delete(shape_id))
+
+    def send_calibration(self, corners):
+        self.send(encode_calibration(corners))
+
+    def send_skip(self, offset=1):
+        self.send(encode_skip(offset))
+
+    def request(self, cmd, timeout=REPLY_TIMEOUT, **params):
+        """
+        Отправляет команду управления и ждёт ответа плеера.
+
+        Возвращает словарь ответа: {'ok': True, ...} или {'ok': False, 'error': ...}.
+        Обрыв соединения или отсутствие ответа за timeout секунд - OSError.
+        """
+        self._request_id += 1
+        self.send(encode_command(dict(params, cmd=cmd, id=self._request_id)))
+        self.sock.settimeout(timeout)
+        try:
+            while True:
+                message = read_message(self.sock)
+                if message is None:
+                    raise ConnectionError("Плеер закрыл соединение, не ответив")
+                kind, data = decode_message(*message)
+                if kind == 'reply' and data.get('id') == self._request_id:
+                    self.sock.settimeout(None)
+                    return data
+        except (OSError, ProtocolError):
+            # Что осталось в соединении, неизвестно - следующая отправка откроет новое
+            self.close()
+            raise
+
+    def confirm(self):
+        """
+        Ждёт, пока плеер ответит на ping. Сообщения одного соединения
+        разбираются по порядку, поэтому ответ означает, что всё
+        отправленное до него плеер принял.
+        """
+        self.request('ping')
+
+    def status(self):
+        """Состояние плеера: кадр, частота, маски выходов, ролик плейлиста"""
+        return self.request('status')['status']
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
@@ -0,0 +1,160 @@
+"""
+Замеры времени по стадиям кадра плеера.
+
+Каждая стадия (декодирование, наложение маски, показ и т.д.) пишет
+длительности в свой кольцевой буфер последних замеров, по нему
+считаются перцентили p50/p95/p99. Пока сбор выключен, start() и stop()
+сразу возвращаются, и затраты сводятся к двум вызовам на стадию.
+"""
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+STAGES = ('decode', 'mask', 'queue', 'present', 'wait', 'interval')
+QUANTILES = (50, 95, 99)
+
+
+class StageMetrics:
+    """Скользящие окна длительностей по стадиям"""
+
+    def __init__(self, window=600, enabled=False):
+        self.enabled = enabled
+        self.window = window
+        self._samples = {stage: np.zeros(window, dtype=np.float64) for stage in STAGES}
+        self._counts = dict.fromkeys(STAGES, 0)
+
+    def start(self):
+        """Момент начала стадии или None, пока сбор выключен"""
+        return time.perf_counter() if self.enabled else None
+
+    def stop(self, stage, started):
+        """Записывает длительность стадии с момента start()"""
+        # Стадия, начатая до включения сбора, не замеряется
+        if self.enabled and started is not None:
+            self.record(stage, time.perf_counter() - started)
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        count = self._counts[stage]
+        self._samples[stage][count % self.window] = seconds
+        self._counts[stage] = count + 1
+
+    def summary(self):
+        """{стадия: (p50, p95, p99, всего замеров)} в секундах по текущему окну"""
+        result = {}
+        for stage in STAGES:
+            count = self._counts[stage]
+            if not count:
+                continue
+            samples = self._samples[stage][:min(count, self.window)]
+            p50, p95, p99 = np.percentile(samples, QUANTILES)
+            result[stage] = (p50, p95, p99, count)
+        return result
+
+    def draw_overlay(self, frame, summary):
+        """Рисует таблицу перцентилей (мс) в левом верхнем углу кадра"""
+        scale = max(frame.shape[0] / 720.0, 0.5)
+        font_scale = 0.5 * scale
+        line = int(22 * scale)
+        x, y = int(10 * scale), line
+        lines = ["stage       p50    p95    p99  ms"]
+        for stage, (p50, p95, p99, _) in summary.items():
+            lines.append(f"{stage:<9} {p50 * 1000:6.2f} {p95 * 1000:6.2f} {p99 * 1000:6.2f}")
+        width = int(330 * scale)
+        cv2.rectangle(frame, (0, 0), (width, y + line * len(lines)), (0, 0, 0), -1)
+        for text in lines:
+            cv2.putText(frame, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+                        (255, 255, 255), max(1, int(scale)), cv2.LINE_AA)
+            y += line
+
+    def to_csv(self, summary, header=False):
+        """Строки CSV: время, стадия, p50/p95/p99 в мс, число замеров"""
+        rows = ["timestamp,stage,p50_ms,p95_ms,p99_ms,count\n"] if header else []
+        now = time.strftime('%Y-%m-%dT%H:%M:%S')
+        for stage, (p50, p95, p99, count) in summary.items():
+            rows.append(f"{now},{stage},{p50 * 1000:.3f},{p95 * 1000:.3f},{p99 * 1000:.3f},{count}\n")
+        return ''.join(rows)
+
+    def to_prometheus(self, summary, frame_stats=None):
+        """Текстовый формат Prometheus: summary по стадиям и счётчики кадров"""
+        lines = ["# HELP tro_stage_seconds Frame stage duration over the rolling window",
+                 "# TYPE tro_stage_seconds summary"]
+        for stage, values in summary.items():
+            for quantile, value in zip(QUANTILES, values[:3]):
+                lines.append(f'tro_stage_seconds{{stage="{stage}",quantile="{quantile / 100}"}} {value:.6f}')
+            lines.append(f'tro_stage_seconds_count{{stage="{stage}"}} {values[3]}')
+        if frame_stats:
+            lines.append("# TYPE tro_frames_total counter")
+            for kind, value in frame_stats.items():
+                lines.append(f'tro_frames_total{{kind="{kind}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter:
+    """
+    Периодическая выгрузка перцентилей в файл и/или на локальный HTTP порт.
+
+    Файл с расширением .csv дополняется строками, любой другой
+    перезаписывается целиком в формате Prometheus.
+    """
+
+    def __init__(self, metrics, path=None, port=None, interval=5.0, frame_stats=None):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.frame_stats = frame_stats
+        self._last_dump = time.monotonic()
+        self._server = None
+        if port:
+            self._start_http(port)
+
+    def _start_http(self, port):
+        # http.server тянет email и http.client - импортируем, только если порт задан
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.metrics.to_prometheus(exporter.metrics.summary(),
+                                                      exporter.frame_stats).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('localhost', port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"Метрики доступны на http://localhost:{port}/metrics")
+
+    def maybe_dump(self):
+        """Вызывается из цикла показа, пишет файл не чаще раза в interval секунд"""
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now - self._last_dump < self.interval:
+            return
+        self._last_dump = now
+        summary = self.metrics.summary()
+        if self.path.endswith('.csv'):
+            header = not os.path.exists(self.path)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(self.metrics.to_csv(summary, header=header))
+        else:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.metrics.to_prometheus(summary, self.frame_stats))
+            os.replace(tmp_path, self.path)
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
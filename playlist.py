@@ -0,0 +1,127 @@
+"""
+Плейлист роликов со своими масками и фоновая подготовка следующего ролика.
+
+Пока играет текущий ролик, фоновый поток открывает следующий и заранее
+декодирует его первые кадры, поэтому переключение происходит на границе
+кадра: поток декодирования плеера сразу берёт готовые кадры, а дальше
+продолжает читать уже открытый файл.
+"""
+import json
+import os
+import threading
+from collections import deque
+
+import cv2
+
+
+def load_playlist(filename):
+    """
+    Читает плейлист: список {"video", "masks" (необязательно), "loops" (по умолчанию 1)}.
+
+    Пути считаются относительно файла плейлиста. Элемент может быть и
+    просто строкой с путём к видео.
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('items', [])
+    base = os.path.dirname(os.path.abspath(filename))
+    items = []
+    for entry in data:
+        item = {'video': entry} if isinstance(entry, str) else dict(entry)
+        for key in ('video', 'masks'):
+            if item.get(key):
+                item[key] = os.path.join(base, item[key])
+        item.setdefault('loops', 1)
+        items.append(item)
+    return items
+
+
+class PreparedClip:
+    """Открытый ролик плейлиста с заранее декодированными первыми кадрами"""
+
+    def __init__(self, index, item, cap, fps, frames, shapes):
+        self.index = index
+        self.item = item
+        self.cap = cap
+        self.fps = fps
+        self.frames = frames  # deque кадров, уже приведённых к размеру кадра плеера
+        self.shapes = shapes  # Фигуры масок ролика или None, если у него нет своих масок
+
+    @property
+    def name(self):
+        return os.path.basename(self.item['video'])
+
+    def release(self):
+        self.frames.clear()
+        self.cap.release()
+
+
+def open_clip(index, item, frame_size, prefetch_frames, load_shapes):
+    """Открывает ролик и декодирует первые prefetch_frames кадров. None - ролик не открылся."""
+    cap = cv2.VideoCapture(item['video'])
+    if not cap.isOpened():
+        print(f"Плейлист: не удалось открыть {item['video']}")
+        return None
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width, height = frame_size
+    frames = deque()
+    for _ in range(prefetch_frames):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if frame.shape[1] != width or frame.shape[0] != height:
+            frame = cv2.resize(frame, (width, height))
+        frames.append(frame)
+    shapes = None
+    if item.get('masks'):
+        try:
+            shapes = load_shapes(item['masks'])
+        except (OSError, ValueError) as e:
+            print(f"Плейлист: не удалось прочитать маски {item['masks']}: {e}")
+    return PreparedClip(index, item, cap, fps if fps and fps > 0 else 30.0, frames, shapes)
+
+
+class ClipPrefetcher:
+    """Готовит в фоне один ролик - тот, что будет играть следующим"""
+
+    def __init__(self, frame_size, prefetch_frames, load_shapes):
+        self.frame_size = frame_size
+        self.prefetch_frames = prefetch_frames
+        self.load_shapes = load_shapes
+        self._index = None
+        self._thread = None
+        self._result = None
+
+    def start(self, index, item):
+        """Начинает готовить ролик index, отменяя прежнюю подготовку."""
+        self.cancel()
+        self._index = index
+        self._thread = threading.Thread(target=self._prepare, args=(index, item), daemon=True)
+        self._thread.start()
+
+    def _prepare(self, index, item):
+        self._result = open_clip(index, item, self.frame_size, self.prefetch_frames, self.load_shapes)
+
+    def take(self, index, item):
+        """
+        Возвращает готовый ролик index. Если готовился другой ролик, этот
+        открывается сразу, в вызывающем потоке.
+        """
+        if self._index == index and self._thread is not None:
+            self._thread.join()
+            clip, self._result = self._result, None
+            self._index = self._thread = None
+            return clip
+        self.cancel()
+        return open_clip(index, item, self.frame_size, self.prefetch_frames, self.load_shapes)
+
+    def cancel(self):
+        if self._thread is not None:
+            self._thread.join()
+            if self._result is not None:
+                self._result.release()
+        self._index = self._thread = self._result = None
+
+    def close(self):
+        self.cancel()
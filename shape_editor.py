@@ -1,22 +1,56 @@
+import startup  # Первым: от его импорта считается время запуска
 import sys
+import argparse
+import itertools
+import threading
+import time
 import numpy as np
 import json
-import socket
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QPushButton,
                              QVBoxLayout, QHBoxLayout, QLabel, QMessageBox,
-                             QFileDialog)
-from PyQt6.QtGui import QPainter, QPen, QColor, QPolygon, QBrush
-from PyQt6.QtCore import Qt, QPoint
+                             QFileDialog, QCheckBox, QSpinBox, QLineEdit,
+                             QDoubleSpinBox)
+from PyQt6.QtGui import (QPainter, QPen, QColor, QPolygonF, QBrush, QImage,
+                         QPainterPath, QPixmap, QShortcut, QKeySequence)
+from PyQt6 import sip
+from PyQt6.QtCore import Qt, QObject, QPoint, QRect, QRectF, QTimer, pyqtSignal
+
+import edit_journal
+import frame_preview
+import mask_protocol
+import spatial_index
+
+startup.mark("импорт модулей")
 
 # ... (Классы Shape и CanvasWidget остаются без изменений, как в предыдущем ответе) ...
 class Shape:
     """
     Класс для представления одной фигуры
+
+    Точки хранятся одним массивом float32 (N, 2) в нормализованных
+    координатах 0..1, пиксельные координаты вычисляются только для
+    отрисовки под текущий размер холста.
     """
-    def __init__(self):
-        self.points = []  # Точки фигуры
+    _next_id = 0
+    _versions = itertools.count(1)
+
+    def __init__(self, shape_id=None):
+        # Постоянный id для точечных обновлений в плеере и для команд журнала правок
+        if shape_id is None:
+            shape_id = Shape._next_id
+        Shape._next_id = max(Shape._next_id, shape_id + 1)
+        self.id = shape_id
+        self._data = np.empty((16, 2), dtype=np.float32)  # Буфер точек с запасом
+        self._count = 0
         self.is_closed = False  # Замкнута ли фигура
+        self.keyframes = []  # [(время в секундах, точки N x 2)] по возрастанию времени
         self.color = self.generate_color()  # Уникальный цвет для каждой фигуры
+        self.invalidate()
+
+    @property
+    def points(self):
+        """Точки фигуры (нормализованные), представление без копирования"""
+        return self._data[:self._count]
 
     def generate_color(self):
         """Генерирует случайный цвет для фигуры"""
@@ -29,47 +63,244 @@ class Shape:
         return colors[np.random.randint(0, len(colors))]
 
 
-    def add_point(self, point):
-        """Добавляет точку к фигуре"""
-        self.points.append(point)
+    def add_point(self, x, y):
+        """Добавляет точку к фигуре (нормализованные координаты)"""
+        self.insert_vertex(self._count, x, y)
+
+    def set_points(self, points):
+        """Заменяет все точки массивом (N, 2) нормализованных координат"""
+        self._data = np.array(points, dtype=np.float32).reshape(-1, 2)
+        self._count = len(self._data)
+        self.invalidate()
+
+    def move_vertex(self, index, x, y):
+        self._data[index] = (x, y)
+        self.invalidate()
+
+    def insert_vertex(self, index, x, y):
+        """Вставляет вершину перед вершиной index (в конец при index == len)"""
+        if self._count == len(self._data):
+            # После set_points([]) буфер пустой - удвоение нуля не дало бы места
+            grown = np.empty((max(16, len(self._data) * 2), 2), dtype=np.float32)
+            grown[:self._count] = self.points
+            self._data = grown
+        self._data[index + 1:self._count + 1] = self._data[index:self._count]
+        self._data[index] = (x, y)
+        self._count += 1
+        self.invalidate()
+
+    def remove_vertex(self, index):
+        self._data[index:self._count - 1] = self._data[index + 1:self._count]
+        self._count -= 1
+        self.invalidate()
+
+    def translate(self, dx, dy):
+        """Сдвигает всю фигуру"""
+        self.points[:] += (dx, dy)
+        self.invalidate()
+
+    def set_keyframe(self, time):
+        """
+        Запоминает текущие точки как ключевой кадр в момент time (секунды видео).
+
+        Ключи с другим числом вершин (после вставки вершины) сбрасываются:
+        плеер интерполирует вершины попарно.
+        """
+        count = len(self.points)
+        if self.keyframes and len(self.keyframes[0][1]) != count:
+            print(f"Число вершин фигуры изменилось, прежние ключевые кадры ({len(self.keyframes)}) сброшены")
+            self.keyframes = []
+        self.keyframes = [k for k in self.keyframes if abs(k[0] - time) > 1e-6]
+        self.keyframes.append((time, self.points.copy()))
+        self.keyframes.sort(key=lambda k: k[0])
 
     def close(self):
         """Замыкает фигуру"""
         if len(self.points) > 2:
             self.is_closed = True
+            self.invalidate()
             return True
         return False
 
-    def get_numpy_points(self):
-        """Возвращает точки в формате NumPy"""
-        if not self.points:
+    def reopen(self):
+        """Снова делает фигуру незамкнутой (отмена замыкания)"""
+        self.is_closed = False
+        self.invalidate()
+
+    def keyframes_data(self):
+        return [{'time': time, 'points': points.astype(np.float64).round(7).tolist()}
+                for time, points in self.keyframes]
+
+    def set_keyframes_data(self, keyframes):
+        self.keyframes = sorted(((float(keyframe['time']),
+                                  np.array(keyframe['points'], dtype=np.float32).reshape(-1, 2))
+                                 for keyframe in keyframes), key=lambda k: k[0])
+
+    def invalidate(self):
+        """Сбрасывает кэш отрисовки после изменения точек"""
+        self._drop_cache()
+        # Новый номер при каждом изменении: по нему живой режим находит изменённые фигуры
+        self.version = next(Shape._versions)
+
+    def _drop_cache(self):
+        self._cache_size = None
+        self._polygon = None
+        self._path = None
+        self._label_pos = None
+
+    def _check_cache(self, width, height):
+        if self._cache_size != (width, height):
+            self._drop_cache()
+            self._cache_size = (width, height)
+
+    def pixel_points(self, width, height):
+        """Точки в пикселях холста, float64 (N, 2)"""
+        return self.points * np.array([width, height], dtype=np.float64)
+
+    def polygon(self, width, height):
+        """QPolygonF в пикселях, заполняется одним копированием массива"""
+        self._check_cache(width, height)
+        if self._polygon is None:
+            self._polygon = points_to_polygon(self.pixel_points(width, height))
+        return self._polygon
+
+    def painter_path(self, width, height):
+        """Контур фигуры, строится один раз до изменения точек или размера холста"""
+        self._check_cache(width, height)
+        if self._path is None:
+            self._path = QPainterPath()
+            self._path.addPolygon(self.polygon(width, height))
+            if self.is_closed:
+                self._path.closeSubpath()
+        return self._path
+
+    def label_pos(self, width, height):
+        self._check_cache(width, height)
+        if self._label_pos is None:
+            center_x, center_y = self.pixel_points(width, height).mean(axis=0)
+            self._label_pos = QPoint(int(center_x), int(center_y))
+        return self._label_pos
+
+    def get_numpy_points(self, width, height):
+        """Возвращает точки в пикселях в формате NumPy"""
+        if not len(self.points):
             return None
-        points_list = [[point.x(), point.y()] for point in self.points]
-        return np.array(points_list, dtype=np.int32)
+        return self.pixel_points(width, height).astype(np.int32)
 
     def to_dict(self):
-        """Конвертирует фигуру в словарь для JSON"""
-        return {
-            'points': [[point.x(), point.y()] for point in self.points],
+        """Конвертирует фигуру в словарь для JSON с относительными координатами"""
+        data = {
+            'id': self.id,
+            # float32 -> float64 даёт хвосты вида 0.0125000001862, округляем до точности float32
+            'points': self.points.astype(np.float64).round(7).tolist(),
             'is_closed': self.is_closed,
-            'color': {
-                'red': self.color.red(),
-                'green': self.color.green(),
-                'blue': self.color.blue(),
-                'alpha': self.color.alpha()
-            }
+            'color': self.color_data()
         }
+        if self.keyframes:
+            data['keyframes'] = self.keyframes_data()
+        return data
+
+    @classmethod
+    def from_dict(cls, data, keep_id=False):
+        """
+        Фигура из словаря to_dict. keep_id - сохранить id (восстановление
+        из журнала правок), иначе фигура получает новый.
+        """
+        shape = cls(data.get('id') if keep_id else None)
+        shape.set_points(data['points'])
+        if data.get('is_closed', False):
+            shape.close()
+        shape.set_keyframes_data(data.get('keyframes', []))
+        if data.get('color'):
+            shape.set_color_data(data['color'])
+        return shape
+
+    def color_data(self):
+        return {
+            'red': self.color.red(),
+            'green': self.color.green(),
+            'blue': self.color.blue(),
+            'alpha': self.color.alpha()
+        }
+
+    def set_color_data(self, color_data):
+        self.color = QColor(
+            color_data.get('red', 255),
+            color_data.get('green', 255),
+            color_data.get('blue', 255),
+            color_data.get('alpha', 255)
+        )
+
+
+def points_to_polygon(points):
+    """Строит QPolygonF из массива (N, 2) одной записью в его память"""
+    polygon = QPolygonF()
+    polygon.resize(len(points))
+    if len(points):
+        data = polygon.data()
+        data.setsize(len(points) * 2 * 8)
+        np.frombuffer(data, dtype=np.float64).reshape(-1, 2)[:] = points
+    return polygon
 
 class CanvasWidget(QWidget):
+    shapes_changed = pyqtSignal()  # Любое изменение набора фигур или их точек
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.shapes = []
         self.current_shape = None
         self.setMinimumSize(600, 400)
         # self.setStyleSheet("background-color: #FFFFFF;") # Убираем стиль, будем рисовать фон вручную
-        self.last_width = self.width()
-        self.last_height = self.height()
-        
+        # Готовые фигуры отрисованы в этот слой, вживую рисуется только текущая.
+        # None - слой нужно перестроить целиком
+        self._layer = None
+
+        # Редактирование готовых фигур: индекс для поиска вершин и рёбер под курсором
+        self.index = spatial_index.ShapeIndex()
+        self._drag = None  # (VERTEX, фигура, номер) или ('shape', фигура, последняя точка)
+        self._editing_shape = None  # Фигура под перетаскиванием рисуется вживую, не из слоя
+        self.active_shape = None  # Последняя замкнутая или правленная фигура - ей ставятся ключи
+        self._drag_origin = None  # Вершина или точка захвата в начале перетаскивания
+        self.setMouseTracking(True)
+
+        # Журнал правок (см. edit_journal): отмена, повтор и восстановление после сбоя
+        # Пока не вызван open_journal, правки помнятся только в памяти
+        self.journal = edit_journal.EditJournal()
+
+        # Фон холста - превью кадра плеера из разделяемой памяти
+        self.preview = frame_preview.PreviewReader()
+        self._preview_frame = None  # Своя копия кадра из разделяемой памяти
+        self.preview_pixmap = None  # Копия, уже масштабированная под размер холста
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setInterval(33)
+        self.preview_timer.timeout.connect(self.poll_preview)
+        self.preview_timer.start()
+
+    def poll_preview(self):
+        """Подключается к превью плеера и перерисовывает холст при новом кадре."""
+        if self.preview.is_stale():
+            # Последний кадр остаётся фоном: он в своей копии, а не в памяти плеера
+            self.preview.close()
+        if self.preview.shm is None:
+            if not self.preview.attach():
+                return
+            self._preview_frame = np.empty((self.preview.height, self.preview.width, frame_preview.CHANNELS),
+                                           dtype=np.uint8)
+        if self._drag is not None:
+            # Перетаскивание перерисовывает только изменённые области, фон сменится после него
+            return
+        if self.preview.read(self._preview_frame):
+            self._scale_preview()
+            self.update()
+
+    def _scale_preview(self):
+        """Масштабирует кадр превью под холст один раз, частичные перерисовки берут из него свою область"""
+        height, width = self._preview_frame.shape[:2]
+        image = QImage(sip.voidptr(self._preview_frame.ctypes.data), width, height,
+                       width * frame_preview.CHANNELS, QImage.Format.Format_BGR888)
+        self.preview_pixmap = QPixmap.fromImage(image.scaled(
+            self.size(), Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation))
+
     def save_to_json(self, filename):
         """Сохраняет все фигуры в JSON файл"""
         data = {
@@ -85,8 +316,9 @@ class CanvasWidget(QWidget):
         }
 
         try:
+            # Без отступов: файл с тысячами точек пишется и читается в разы быстрее
             with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+                json.dump(data, f, separators=(',', ':'), ensure_ascii=False)
             return True
         except Exception as e:
             print(f"Ошибка сохранения: {e}")
@@ -94,21 +326,7 @@ class CanvasWidget(QWidget):
 
     def shape_to_dict(self, shape):
         """Конвертирует фигуру в словарь для JSON с относительными координатами"""
-        width = self.width()
-        height = self.height()
-        if width == 0 or height == 0:
-             return { 'points': [], 'is_closed': shape.is_closed, 'color': {} }
-
-        return {
-            'points': [[point.x() / width, point.y() / height] for point in shape.points],
-            'is_closed': shape.is_closed,
-            'color': {
-                'red': shape.color.red(),
-                'green': shape.color.green(),
-                'blue': shape.color.blue(),
-                'alpha': shape.color.alpha()
-            }
-        }
+        return shape.to_dict()
 
     def load_from_json(self, filename):
         """Загружает фигуры из JSON файла"""
@@ -116,27 +334,18 @@ class CanvasWidget(QWidget):
             with open(filename, 'r', encoding='utf-8') as f:
                 data = json.load(f)
 
-            self.shapes = []
-            width = self.width()
-            height = self.height()
-            for shape_data in data.get('shapes', []):
-                shape = Shape()
-                for point in shape_data['points']:
-                    shape.add_point(QPoint(int(point[0] * width), int(point[1] * height)))
-                if shape_data.get('is_closed', False):
-                    shape.close()
-                color_data = shape_data.get('color', {})
-                if color_data:
-                    shape.color = QColor(
-                        color_data.get('red', 255),
-                        color_data.get('green', 255),
-                        color_data.get('blue', 255),
-                        color_data.get('alpha', 255)
-                    )
-                self.shapes.append(shape)
+            before = [shape.to_dict() for shape in self.shapes]
+            self.shapes = [Shape.from_dict(shape_data) for shape_data in data.get('shapes', [])]
+            self._record({'op': 'replace', 'before': before,
+                          'after': [shape.to_dict() for shape in self.shapes]})
 
             self.current_shape = None
+            self._layer = None
+            self.index.clear()
+            for shape in self.shapes:
+                self.index.add_shape(shape)
             self.update()
+            self.shapes_changed.emit()
             print(f"Загружено {len(self.shapes)} фигур из {filename}")
             return True
 
@@ -144,136 +353,610 @@ class CanvasWidget(QWidget):
             print(f"Ошибка загрузки: {e}")
             return False
 
+    def document(self):
+        """Все фигуры для снимка журнала правок"""
+        return {'shapes': [shape.to_dict() for shape in self.shapes], 'next_id': Shape._next_id}
+
+    def _load_document(self, document):
+        self.shapes = [Shape.from_dict(data, keep_id=True) for data in document['shapes']]
+        Shape._next_id = max(Shape._next_id, document.get('next_id', 0))
+        # Фигура, которую рисовали в момент сбоя, остаётся текущей
+        self.current_shape = next((shape for shape in reversed(self.shapes) if not shape.is_closed), None)
+
+    def open_journal(self, path=edit_journal.DEFAULT_PATH):
+        """Подключает журнал правок на диске и восстанавливает из него прошлую сессию"""
+        try:
+            journal = edit_journal.open_exclusive(path)
+        except OSError as e:
+            print(f"Журнал правок отключён: {e}")
+            return
+        if journal is None:
+            print(f"Журнал правок отключён: {path} и все запасные журналы заняты другими редакторами. "
+                  "Отмена работает, но правки не переживут сбой")
+            return
+        self.journal = journal
+        replayed = self.journal.recover(self._load_document, self.apply_command)
+        if self.shapes or replayed:
+            print(f"Восстановлено фигур: {len(self.shapes)}, проиграно записей журнала: {replayed}")
+        self._history_changed()
+        # Снимок сразу после восстановления: журнал начинается с чистого листа
+        self.compact_journal()
+
+    def compact_journal(self):
+        try:
+            self.journal.compact(self.document())
+        except OSError as e:
+            print(f"Журнал правок отключён, не удалось записать снимок: {e}")
+
+    def _record(self, command):
+        """Записывает выполненную правку в журнал"""
+        self.journal.record(command)
+        if self.journal.needs_snapshot:
+            self.compact_journal()
+
+    def _shape_by_id(self, shape_id):
+        return next((shape for shape in self.shapes if shape.id == shape_id), None)
+
+    def apply_command(self, command, forward=True):
+        """
+        Выполняет (forward) или откатывает команду журнала правок.
+
+        Меняет только фигуры; индекс, слой и перерисовку обновляет
+        _history_changed.
+        """
+        op = command['op']
+        if op == 'replace':
+            self.shapes = [Shape.from_dict(data, keep_id=True)
+                           for data in command['after' if forward else 'before']]
+            self.current_shape = None
+        elif op == 'delete':
+            if forward:
+                shape = self._shape_by_id(command['shape']['id'])
+                if shape is not None:  # Запись журнала могла пережить саму фигуру
+                    self.shapes.remove(shape)
+            else:
+                shape = Shape.from_dict(command['shape'], keep_id=True)
+                self.shapes.insert(command['index'], shape)
+                if not shape.is_closed and self.current_shape is None:
+                    self.current_shape = shape
+        else:
+            shape = self._shape_by_id(command['shape'])
+            if op == 'add_point':
+                if forward:
+                    if shape is None:
+                        shape = Shape(command['shape'])
+                        shape.set_color_data(command['color'])
+                        self.shapes.append(shape)
+                    shape.add_point(*command['point'])
+                    self.current_shape = shape
+                else:
+                    shape.remove_vertex(len(shape.points) - 1)
+                    if len(shape.points):
+                        self.current_shape = shape
+                    else:
+                        self.shapes.remove(shape)
+            elif op == 'close':
+                if forward:
+                    shape.close()
+                    if self.current_shape is shape:
+                        self.current_shape = None
+                else:
+                    shape.reopen()
+                    self.current_shape = shape
+            elif op == 'insert_vertex':
+                if forward:
+                    shape.insert_vertex(command['index'], *command['point'])
+                else:
+                    shape.remove_vertex(command['index'])
+            elif op == 'move_vertex':
+                shape.move_vertex(command['index'], *command['to' if forward else 'from'])
+            elif op == 'translate':
+                dx, dy = command['delta']
+                shape.translate(dx, dy) if forward else shape.translate(-dx, -dy)
+            elif op == 'keyframes':
+                shape.set_keyframes_data(command['after' if forward else 'before'])
+        if self.current_shape not in self.shapes:
+            self.current_shape = None
+        if self.active_shape not in self.shapes:
+            self.active_shape = None
+
+    @staticmethod
+    def _command_shape_id(command):
+        """id фигуры, которую меняет команда журнала; None - команда меняет весь документ"""
+        op = command['op']
+        if op == 'replace':
+            return None
+        return command['shape']['id'] if op == 'delete' else command['shape']
+
+    def _command_rect(self, command):
+        """Область, которую занимает фигура команды до её выполнения или отката"""
+        shape_id = self._command_shape_id(command)
+        shape = None if shape_id is None else self._shape_by_id(shape_id)
+        return QRect() if shape is None else self._shape_rect(shape)
+
+    def _history_changed(self, command=None, old_rect=None):
+        """
+        Обновление после отмены, повтора или восстановления.
+
+        Для команды над одной фигурой переиндексируется только она, а слой
+        перерисовывается в её области и только если фигура была или стала
+        замкнутой. Без команды (восстановление, замена документа) - полное.
+        """
+        self._editing_shape = None
+        shape_id = None if command is None else self._command_shape_id(command)
+        if shape_id is None:
+            self._layer = None
+            self.index.clear()
+            for shape in self.shapes:
+                if shape.is_closed:
+                    self.index.add_shape(shape)
+            self.update()
+            self.shapes_changed.emit()
+            return
+
+        shape = self._shape_by_id(shape_id)
+        # В индексе и в слое только замкнутые фигуры
+        indexed = self.index.shapes.get(shape_id)
+        if indexed is not None:
+            self.index.remove_shape(indexed)
+        closed = shape is not None and shape.is_closed
+        if closed:
+            self.index.add_shape(shape)
+        rect = QRect() if old_rect is None else old_rect
+        if shape is not None:
+            rect = rect.united(self._shape_rect(shape))
+        if (indexed is not None or closed) and command['op'] == 'delete':
+            # Номера фигур после удалённой или вернувшейся сдвигаются - перерисовываем слой целиком
+            self._layer = None
+            self.update()
+        else:
+            if indexed is not None or closed:
+                self._redraw_layer_rect(rect)
+            self.update(rect)
+        self.shapes_changed.emit()
+
+    def undo(self):
+        if self._drag is not None:
+            return False
+        command = self.journal.undo()
+        if command is None:
+            print("Нечего отменять.")
+            return False
+        old_rect = self._command_rect(command)
+        self.apply_command(command, forward=False)
+        self._history_changed(command, old_rect)
+        if self.journal.needs_snapshot:
+            self.compact_journal()
+        return True
+
+    def redo(self):
+        if self._drag is not None:
+            return False
+        command = self.journal.redo()
+        if command is None:
+            print("Нечего повторять.")
+            return False
+        old_rect = self._command_rect(command)
+        self.apply_command(command, forward=True)
+        self._history_changed(command, old_rect)
+        if self.journal.needs_snapshot:
+            self.compact_journal()
+        return True
+
     def resizeEvent(self, event):
         """Обработчик изменения размера виджета"""
-        if self.shapes and hasattr(self, 'last_width') and self.last_width > 0 and self.last_height > 0:
-             self.rescale_shapes(event.oldSize().width(), event.oldSize().height())
-        self.last_width = self.width()
-        self.last_height = self.height()
+        # Точки хранятся нормализованными, пересчитывать их не нужно
+        self._layer = None
+        if self.preview_pixmap is not None:
+            self._scale_preview()
         super().resizeEvent(event)
 
-    def rescale_shapes(self, old_width, old_height):
-        """Пересчитывает координаты точек фигур при изменении размера виджета"""
-        new_width = self.width()
-        new_height = self.height()
-
-        for shape in self.shapes:
-            new_points = []
-            for point in shape.points:
-                relative_x = point.x() / old_width
-                relative_y = point.y() / old_height
-                new_points.append(QPoint(int(relative_x * new_width), int(relative_y * new_height)))
-            shape.points = new_points
-        self.update()
+    def _normalized_pos(self, event):
+        pos = event.position()
+        return (min(max(pos.x() / self.width(), 0.0), 1.0),
+                min(max(pos.y() / self.height(), 0.0), 1.0))
+
+    def _pick(self, x, y):
+        return self.index.pick(x, y, self.width(), self.height(), self.PICK_RADIUS)
+
+    def _shape_at(self, event):
+        """Верхняя готовая фигура, внутри которой находится курсор"""
+        width, height = self.width(), self.height()
+        pos = event.position()
+        for shape in reversed(self.shapes):
+            if shape is self.current_shape or not shape.is_closed:
+                continue
+            polygon = shape.polygon(width, height)
+            if polygon.boundingRect().contains(pos) and \
+                    polygon.containsPoint(pos, Qt.FillRule.OddEvenFill):
+                return shape
+        return None
+
+    def _start_drag(self, drag):
+        """Переводит фигуру в режим редактирования: она рисуется вживую, не из слоя"""
+        kind, shape, target = drag
+        self._drag_origin = shape.points[target].tolist() if kind == spatial_index.VERTEX else target
+        self._drag = drag
+        self._editing_shape = drag[1]
+        self.active_shape = drag[1]
+        rect = self._shape_rect(drag[1])
+        self._redraw_layer_rect(rect)
+        self.update(rect)
+
+    def _begin_edit(self, event):
+        """Начинает перетаскивание вершины, ребра или фигуры. False - ничего не задето"""
+        x, y = self._normalized_pos(event)
+        if event.modifiers() & Qt.KeyboardModifier.ShiftModifier:
+            shape = self._shape_at(event)
+            if shape is not None:
+                self._start_drag(('shape', shape, (x, y)))
+                return True
+        hit = self._pick(x, y)
+        if hit is None:
+            return False
+        kind, shape, i, point = hit
+        if kind == spatial_index.EDGE:
+            # Клик по ребру вставляет на нём вершину и сразу её перетаскивает
+            i += 1
+            shape.insert_vertex(i, *point)
+            self._record({'op': 'insert_vertex', 'shape': shape.id, 'index': i,
+                          'point': shape.points[i].tolist()})
+            self.index.add_shape(shape)
+            self.shapes_changed.emit()
+        self._start_drag((spatial_index.VERTEX, shape, i))
+        return True
+
+    def mouseMoveEvent(self, event):
+        if self._drag is None:
+            if self.current_shape is None:
+                hit = self._pick(*self._normalized_pos(event))
+                if hit is None:
+                    self.unsetCursor()
+                elif hit[0] == spatial_index.VERTEX:
+                    self.setCursor(Qt.CursorShape.SizeAllCursor)
+                else:
+                    self.setCursor(Qt.CursorShape.CrossCursor)
+            return
+
+        kind, shape, target = self._drag
+        old_rect = self._shape_rect(shape)
+        x, y = self._normalized_pos(event)
+        if kind == spatial_index.VERTEX:
+            shape.move_vertex(target, x, y)
+            self.index.update_vertex(shape, target)
+        else:
+            shape.translate(x - target[0], y - target[1])
+            self._drag = (kind, shape, (x, y))
+        self.update(old_rect.united(self._shape_rect(shape)))
+        self.shapes_changed.emit()
 
+    def mouseReleaseEvent(self, event):
+        if event.button() != Qt.MouseButton.LeftButton or self._drag is None:
+            return
+        kind, shape, target = self._drag
+        # Перетаскивание целиком - одна команда журнала, промежуточные положения не пишутся
+        if kind == 'shape':
+            # Вершины сдвинутой фигуры переиндексируем один раз, в конце перетаскивания
+            self.index.add_shape(shape)
+            delta = [target[0] - self._drag_origin[0], target[1] - self._drag_origin[1]]
+            if delta != [0, 0]:
+                self._record({'op': 'translate', 'shape': shape.id, 'delta': delta})
+        else:
+            point = shape.points[target].tolist()
+            if point != self._drag_origin:
+                self._record({'op': 'move_vertex', 'shape': shape.id, 'index': target,
+                              'from': self._drag_origin, 'to': point})
+        self._drag = None
+        self._editing_shape = None
+        rect = self._shape_rect(shape)
+        self._redraw_layer_rect(rect)
+        self.update(rect)
 
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.LeftButton:
+            if self.current_shape is None and self._begin_edit(event):
+                return
+            command = {'op': 'add_point'}
             if self.current_shape is None:
                 self.current_shape = Shape()
                 self.shapes.append(self.current_shape)
-                if not hasattr(self, 'last_width') or self.last_width == 0:
-                     self.last_width = self.width()
-                     self.last_height = self.height()
-            self.current_shape.add_point(event.pos())
-            self.update()
+                command['color'] = self.current_shape.color_data()
+            width, height = self.width(), self.height()
+            pos = event.position()
+            points = self.current_shape.points
+            previous = (points[-1] * (width, height)) if len(points) else (pos.x(), pos.y())
+            self.current_shape.add_point(pos.x() / width, pos.y() / height)
+            command.update(shape=self.current_shape.id, point=self.current_shape.points[-1].tolist())
+            self._record(command)
+            # Перерисовываем только новую точку и отрезок до неё
+            m = self.POINT_MARGIN
+            rect = QRectF(previous[0], previous[1], pos.x() - previous[0], pos.y() - previous[1])
+            self.update(rect.normalized().toAlignedRect().adjusted(-m, -m, m, m))
+            self.shapes_changed.emit()
         elif event.button() == Qt.MouseButton.RightButton:
-            if self.current_shape and not self.current_shape.is_closed:
-                if self.current_shape.close():
-                    print(f"Фигура {len(self.shapes)} замкнута. Вершин: {len(self.current_shape.points)}")
+            shape = self.current_shape
+            if shape and not shape.is_closed:
+                if shape.close():
+                    self._record({'op': 'close', 'shape': shape.id})
+                    print(f"Фигура {len(self.shapes)} замкнута. Вершин: {len(shape.points)}")
+                    self.current_shape = None
+                    self.active_shape = shape
+                    self.index.add_shape(shape)
+                    self._add_to_layer(shape)
                 else:
-                    if len(self.current_shape.points) < 3 and self.current_shape in self.shapes:
-                        self.shapes.remove(self.current_shape)
+                    if len(shape.points) < 3 and shape in self.shapes:
+                        self._record({'op': 'delete', 'index': self.shapes.index(shape), 'shape': shape.to_dict()})
+                        self.shapes.remove(shape)
                         print("Фигура удалена - недостаточно точек для замыкания")
+                self.update(self._shape_rect(shape))
             self.current_shape = None
-            self.update()
+            self.shapes_changed.emit()
+
+    # Запас вокруг геометрии на толщину точек (перо 8px) при частичной перерисовке
+    POINT_MARGIN = 6
+    # Допуск попадания по вершине или ребру, в пикселях
+    PICK_RADIUS = 8
+
+    def _shape_rect(self, shape):
+        """Область виджета, которую занимает фигура вместе с точками и номером"""
+        if not len(shape.points):
+            return QRect()
+        width, height = self.width(), self.height()
+        m = self.POINT_MARGIN
+        rect = shape.polygon(width, height).boundingRect().toAlignedRect().adjusted(-m, -m, m, m)
+        if shape.is_closed:
+            pos = shape.label_pos(width, height)
+            label = self.fontMetrics().boundingRect(str(len(self.shapes) + 1))
+            rect = rect.united(label.translated(pos.x() - 10, pos.y()).adjusted(-m, -m, m, m))
+        return rect
+
+    def _draw_shape(self, painter, shape, index):
+        if not len(shape.points):
+            return
+        width, height = self.width(), self.height()
+
+        point_color = shape.color.lighter(150)
+        painter.setPen(QPen(point_color, 8, Qt.PenStyle.SolidLine))
+        painter.drawPoints(shape.polygon(width, height))
+
+        line_color = shape.color.lighter(100)
+        painter.setPen(QPen(line_color, 2, Qt.PenStyle.SolidLine))
+        if shape.is_closed and len(shape.points) > 2:
+            fill_color = QColor(shape.color)
+            fill_color.setAlpha(60) # Сделаем заливку еще более прозрачной
+            painter.setBrush(QBrush(fill_color))
+            painter.drawPath(shape.painter_path(width, height))
+
+            pos = shape.label_pos(width, height)
+            painter.setPen(QPen(Qt.GlobalColor.white, 1))
+            painter.drawText(pos.x() - 10, pos.y(), f"{index+1}")
+        elif len(shape.points) > 1:
+            painter.setBrush(Qt.BrushStyle.NoBrush)
+            painter.drawPath(shape.painter_path(width, height))
+
+    def _layer_painter(self):
+        painter = QPainter(self._layer)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        return painter
+
+    def _rebuild_layer(self):
+        """Отрисовывает все готовые фигуры в кэшированный слой"""
+        ratio = self.devicePixelRatioF()
+        self._layer = QPixmap(self.size() * ratio)
+        self._layer.setDevicePixelRatio(ratio)
+        self._layer.fill(Qt.GlobalColor.transparent)
+        painter = self._layer_painter()
+        for i, shape in enumerate(self.shapes):
+            if shape is not self.current_shape and shape is not self._editing_shape:
+                self._draw_shape(painter, shape, i)
+        painter.end()
+
+    def _add_to_layer(self, shape):
+        """Дорисовывает только что замкнутую фигуру поверх готового слоя"""
+        if self._layer is None:
+            return
+        painter = self._layer_painter()
+        self._draw_shape(painter, shape, self.shapes.index(shape))
+        painter.end()
+
+    def _redraw_layer_rect(self, rect):
+        """
+        Перерисовывает в слое только область rect: фигуры, которые её задевают,
+        в прежнем порядке. Так фигура уходит из слоя на время перетаскивания и
+        возвращается после него без перерисовки всего слоя.
+        """
+        if self._layer is None or rect.isEmpty():
+            return
+        painter = self._layer_painter()
+        painter.setClipRect(rect)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
+        painter.fillRect(rect, Qt.GlobalColor.transparent)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+        for i, shape in enumerate(self.shapes):
+            if shape is self.current_shape or shape is self._editing_shape:
+                continue
+            if self._shape_rect(shape).intersects(rect):
+                self._draw_shape(painter, shape, i)
+        painter.end()
 
     def paintEvent(self, event):
         painter = QPainter(self)
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
 
+        if self.preview_pixmap is not None:
+            painter.drawPixmap(event.rect(), self.preview_pixmap, event.rect())
         painter.fillRect(self.rect(), QColor("#39427535"))
 
-        for i, shape in enumerate(self.shapes):
-            if not shape.points: continue
-            
-            point_color = shape.color.lighter(150)
-            painter.setPen(QPen(point_color, 8, Qt.PenStyle.SolidLine))
-            for point in shape.points:
-                painter.drawPoint(point)
-
-            line_color = shape.color.lighter(100)
-            painter.setPen(QPen(line_color, 2, Qt.PenStyle.SolidLine))
-            if len(shape.points) > 1:
-                painter.drawPolyline(QPolygon(shape.points))
+        if self._layer is None:
+            self._rebuild_layer()
+        painter.drawPixmap(0, 0, self._layer)
 
-            if shape.is_closed and len(shape.points) > 2:
-                painter.drawLine(shape.points[-1], shape.points[0])
-                fill_color = QColor(shape.color)
-                fill_color.setAlpha(60) # Сделаем заливку еще более прозрачной
-                brush = QBrush(fill_color)
-                painter.setBrush(brush)
-                polygon = QPolygon(shape.points)
-                painter.drawPolygon(polygon)
-                
-                if shape.points:
-                    center_x = sum(p.x() for p in shape.points) // len(shape.points)
-                    center_y = sum(p.y() for p in shape.points) // len(shape.points)
-                    painter.setPen(QPen(Qt.GlobalColor.white, 1))
-                    painter.drawText(center_x - 10, center_y, f"{i+1}")
+        for shape in (self._editing_shape, self.current_shape):
+            if shape is not None:
+                self._draw_shape(painter, shape, self.shapes.index(shape))
     
     def close_current_shape(self):
-        if self.current_shape and not self.current_shape.is_closed:
-            if self.current_shape.close():
+        shape = self.current_shape
+        if shape and not shape.is_closed:
+            if shape.close():
+                self._record({'op': 'close', 'shape': shape.id})
                 print(f"Фигура {len(self.shapes)} замкнута.")
                 self.current_shape = None
-                self.update()
+                self.active_shape = shape
+                self.index.add_shape(shape)
+                self._add_to_layer(shape)
+                self.update(self._shape_rect(shape))
+                self.shapes_changed.emit()
                 return True
         return False
 
     def clear_all(self):
+        if self.shapes:
+            self._record({'op': 'replace', 'before': [shape.to_dict() for shape in self.shapes], 'after': []})
         self.shapes = []
         self.current_shape = None
+        self._drag = None
+        self._editing_shape = None
+        self.active_shape = None
+        self.index.clear()
+        self._layer = None
         self.update()
+        self.shapes_changed.emit()
         print("Все фигуры удалены.")
     
     def delete_last_shape(self):
         if self.shapes:
+            self._record({'op': 'delete', 'index': len(self.shapes) - 1, 'shape': self.shapes[-1].to_dict()})
             removed_shape = self.shapes.pop()
+            self.index.remove_shape(removed_shape)
+            if self._editing_shape is removed_shape:
+                self._drag = None
+                self._editing_shape = None
+            if self.active_shape is removed_shape:
+                self.active_shape = None
             if self.current_shape == removed_shape:
                 self.current_shape = None
-            self.update()
+            else:
+                self._layer = None
+            self.update(self._shape_rect(removed_shape))
+            self.shapes_changed.emit()
             print(f"Удалена фигура. Осталось фигур: {len(self.shapes)}")
         else:
             print("Нет фигур для удаления.")
     
+    def add_keyframe(self, time):
+        """Ставит ключевой кадр активной фигуре (последней замкнутой, если ничего не правили)"""
+        shape = self.active_shape
+        if shape is None:
+            shape = next((s for s in reversed(self.shapes) if s.is_closed), None)
+        if shape is None:
+            return None
+        before = shape.keyframes_data()
+        shape.set_keyframe(time)
+        self._record({'op': 'keyframes', 'shape': shape.id, 'before': before, 'after': shape.keyframes_data()})
+        print(f"Ключевой кадр {time:.2f} с для фигуры {self.shapes.index(shape) + 1}, "
+              f"всего ключей: {len(shape.keyframes)}")
+        return shape
+
+    def shapes_payload(self, include_current=False):
+        """
+        Фигуры для отправки в плеер: точки передаются массивами без копирования.
+
+        include_current - для живого режима добавить и рисуемую фигуру,
+        если в ней уже 3 точки.
+        """
+        return [self.shape_payload(shape) for shape in self.sendable_shapes(include_current)]
+
+    def sendable_shapes(self, include_current=False):
+        """Фигуры, которые уходят в плеер (см. shapes_payload)"""
+        return [shape for shape in self.shapes
+                if shape.is_closed or (include_current and shape is self.current_shape
+                                       and len(shape.points) > 2)]
+
+    @staticmethod
+    def shape_payload(shape):
+        return {'id': shape.id, 'points': shape.points, 'is_closed': True}
+
     def get_all_shapes_as_numpy(self):
         shapes_data = []
         for i, shape in enumerate(self.shapes):
             if shape.is_closed and len(shape.points) > 2:
-                points_np = shape.get_numpy_points()
+                points_np = shape.get_numpy_points(self.width(), self.height())
                 if points_np is not None:
                     shapes_data.append({'id': i, 'points': points_np, 'color': shape.color})
         return shapes_data
 
 
+class CommandReader(QObject):
+    """
+    Команды плеера из stdin для заранее запущенного редактора (--hidden).
+
+    Читает строки в фоновом потоке, сигнал доставляется в поток окна.
+    Конец stdin - плеер завершился, редактору пора выйти.
+    """
+    received = pyqtSignal(str)
+
+    def start(self):
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in sys.stdin:
+            if line.strip():
+                self.received.emit(line.strip())
+        self.received.emit('quit')
+
+
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, journal_path=edit_journal.DEFAULT_PATH):
         super().__init__()
         self.setWindowTitle("Редактор форм для маски")
+        # Заранее запущенный плеером редактор: закрытие окна только прячет его
+        self.hosted = False
+        self._quitting = False
+        self.startup_report = False
         self.canvas = CanvasWidget()
+        # Без журнала на диске отмена работает только в пределах сеанса
+        if journal_path:
+            self.canvas.open_journal(journal_path)
+        self.client = mask_protocol.MaskClient()  # Постоянное соединение с плеером
 
         # Создаем кнопки
         self.btn_close = QPushButton("Замкнуть текущую фигуру")
         self.btn_delete_last = QPushButton("Удалить последнюю фигуру")
         self.btn_clear = QPushButton("Очистить все")
+        self.btn_undo = QPushButton("Отменить")
+        self.btn_redo = QPushButton("Повторить")
 
         
         # ================== ИЗМЕНЕНИЕ 1: Текст кнопки ==================
         self.btn_send = QPushButton("Отправить и Очистить")
 
+        # Живой режим: набор фигур отправляется в плеер прямо во время рисования
+        self.live_checkbox = QCheckBox("Живой режим")
+        self.live_rate = QSpinBox()
+        self.live_rate.setRange(1, 120)
+        self.live_rate.setValue(30)
+        self.live_rate.setSuffix(" Гц")
+        self.live_timer = QTimer(self)
+        self.live_dirty = False
+        # id фигуры -> версия, уже отправленная плееру в живом режиме; None - нужен полный набор
+        self._live_sent = None
+
+        # Ключевые кадры: текущая форма фигуры запоминается на заданный момент видео
+        self.keyframe_time = QDoubleSpinBox()
+        self.keyframe_time.setRange(0.0, 86400.0)
+        self.keyframe_time.setDecimals(2)
+        self.keyframe_time.setSuffix(" с")
+        self.btn_keyframe = QPushButton("Ключевой кадр")
+
+        # Выход плеера (проектор), которому адресованы маски
+        self.output_edit = QLineEdit(mask_protocol.DEFAULT_OUTPUT)
+        self.output_edit.setPlaceholderText("Выход плеера")
+        self.output_edit.setMaximumWidth(120)
+
         # Информационная метка
-        self.info_label = QLabel("Левый клик - добавить точку | Правый клик - завершить фигуру")
+        self.info_label = QLabel("Левый клик - добавить точку | Правый клик - завершить фигуру | "
+                                 "Тянуть вершину или ребро - правка | Shift+тянуть - сдвиг фигуры")
         self.info_label.setStyleSheet("color: #ccc; padding: 5px;")
 
         # Привязываем функции
@@ -281,17 +964,35 @@ class MainWindow(QMainWindow):
         self.btn_delete_last.clicked.connect(self.canvas.delete_last_shape)
         self.btn_clear.clicked.connect(self.canvas.clear_all)
         self.btn_send.clicked.connect(self.send_shapes)
+        self.live_checkbox.toggled.connect(self.set_live_mode)
+        self.live_rate.valueChanged.connect(self.set_live_rate)
+        self.live_timer.timeout.connect(self.send_live_update)
+        self.canvas.shapes_changed.connect(self.mark_live_dirty)
+        self.output_edit.editingFinished.connect(self.select_output)
+        self.btn_keyframe.clicked.connect(self.add_keyframe)
+        self.btn_undo.clicked.connect(self.canvas.undo)
+        self.btn_redo.clicked.connect(self.canvas.redo)
+        QShortcut(QKeySequence.StandardKey.Undo, self).activated.connect(self.canvas.undo)
+        QShortcut(QKeySequence.StandardKey.Redo, self).activated.connect(self.canvas.redo)
 
         # Компоновка интерфейса
         button_layout1 = QHBoxLayout()
         button_layout1.addWidget(self.btn_close)
        
         button_layout1.addWidget(self.btn_delete_last)
+        button_layout1.addWidget(self.btn_undo)
+        button_layout1.addWidget(self.btn_redo)
+        button_layout1.addWidget(self.keyframe_time)
+        button_layout1.addWidget(self.btn_keyframe)
 
         button_layout2 = QHBoxLayout()
         button_layout2.addWidget(self.btn_clear)
 
         button_layout2.addWidget(self.btn_send)
+        button_layout2.addWidget(self.live_checkbox)
+        button_layout2.addWidget(self.live_rate)
+        button_layout2.addWidget(QLabel("Выход:"))
+        button_layout2.addWidget(self.output_edit)
 
         main_layout = QVBoxLayout()
         main_layout.addWidget(self.canvas)
@@ -307,42 +1008,165 @@ class MainWindow(QMainWindow):
 
     def send_shapes(self):
         """Собирает, сериализует и отправляет данные, а затем очищает холст."""
-        shapes_data = [shape.to_dict() for shape in self.canvas.shapes if shape.is_closed]
-        
         if not self.canvas.shapes or not any(s.is_closed for s in self.canvas.shapes):
             QMessageBox.warning(self, "Ошибка", "Нет замкнутых фигур для отправки.")
             return
-            
-        width = self.canvas.width()
-        height = self.canvas.height()
-        for shape_dict in shapes_data:
-            shape_dict['points'] = [[p[0] / width, p[1] / height] for p in shape_dict['points']]
 
-        shapes_data = [self.canvas.shape_to_dict(shape) for shape in self.canvas.shapes if shape.is_closed]
+        shapes_data = self.canvas.shapes_payload()
         try:
-            json_data = json.dumps(shapes_data).encode('utf-8')
+            message = mask_protocol.encode_set(shapes_data)
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Ошибка сериализации данных: {e}")
             return
 
-        HOST, PORT = "localhost", 12345
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                sock.connect((HOST, PORT))
-                sock.sendall(json_data)
-            
+            self.client.send(message)
+            # Без подтверждения фигуры могли уйти в уже закрытое плеером соединение -
+            # тогда холст не очищаем
+            self.client.confirm()
+
             QMessageBox.information(self, "Успех", "Маски успешно отправлены!")
             
             # ================== ИЗМЕНЕНИЕ 2: Очистка вместо закрытия ==================
             self.canvas.clear_all()
+            # Отправленный набор остаётся в плеере, очистка холста не должна его стереть:
+            # новые фигуры живой режим будет добавлять к нему
+            self.live_dirty = False
+            self._live_sent = {}
 
         except ConnectionRefusedError:
             QMessageBox.critical(self, "Ошибка", "Не удалось подключиться к основному приложению. Убедитесь, что оно запущено.")
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Произошла ошибка при отправке: {e}")
 
+    def add_keyframe(self):
+        if self.canvas.add_keyframe(self.keyframe_time.value()) is None:
+            QMessageBox.warning(self, "Ошибка", "Нет замкнутой фигуры для ключевого кадра.")
+
+    def select_output(self):
+        """Переключает выход плеера, которому уходят следующие наборы фигур."""
+        name = self.output_edit.text().strip() or mask_protocol.DEFAULT_OUTPUT
+        if name == self.client.output:
+            return
+        try:
+            self.client.select_output(name)
+        except OSError:
+            # Нет связи - выход будет выбран при следующем подключении
+            self.client.close()
+        self.live_dirty = True
+        self._live_sent = None
+
+    def set_live_mode(self, enabled):
+        if enabled:
+            self.set_live_rate(self.live_rate.value())
+            self.live_dirty = True
+            self._live_sent = None
+            self.live_timer.start()
+        else:
+            self.live_timer.stop()
+
+    def set_live_rate(self, rate):
+        """Ограничивает частоту отправки в живом режиме (сообщений в секунду)."""
+        self.live_timer.setInterval(max(1, 1000 // rate))
+
+    def mark_live_dirty(self):
+        self.live_dirty = True
+
+    def send_live_update(self):
+        """
+        По таймеру отправляет плееру только изменившиеся фигуры (точечные
+        обновления и удаления). Полный набор - при включении режима, смене
+        выхода и после переподключения к плееру.
+        """
+        if not self.live_dirty:
+            return
+        self.live_dirty = False
+        shapes = self.canvas.sendable_shapes(include_current=True)
+        connections = self.client.connections
+        try:
+            if self._live_sent is None:
+                self.client.send_set([self.canvas.shape_payload(shape) for shape in shapes])
+            else:
+                parts = [mask_protocol.encode_delete(shape_id)
+                         for shape_id in self._live_sent.keys() - {shape.id for shape in shapes}]
+                parts.extend(mask_protocol.encode_upsert(self.canvas.shape_payload(shape))
+                             for shape in shapes if self._live_sent.get(shape.id) != shape.version)
+                if parts:
+                    self.client.send(b''.join(parts))
+                if self.client.connections != connections:
+                    # Новое соединение: плеер мог перезапуститься и не знать прежних фигур
+                    self.client.send_set([self.canvas.shape_payload(shape) for shape in shapes])
+            self._live_sent = {shape.id: shape.version for shape in shapes}
+        except OSError as e:
+            self._live_sent = None
+            self.live_checkbox.setChecked(False)
+            QMessageBox.critical(self, "Ошибка", f"Живой режим остановлен, нет связи с плеером: {e}")
+
+    def handle_command(self, command):
+        """Команда плеера из CommandReader"""
+        if command == 'show':
+            requested = time.perf_counter()
+            self.show()
+            self.raise_()
+            self.activateWindow()
+            if self.startup_report:
+                QTimer.singleShot(0, lambda: print(
+                    f"Редактор показан за {(time.perf_counter() - requested) * 1000:.1f} мс после запроса"))
+        elif command == 'quit':
+            self._quitting = True
+            self.close()
+            QApplication.quit()
+        else:
+            print(f"Редактор: неизвестная команда плеера {command!r}")
+
+    def closeEvent(self, event):
+        if self.hosted and not self._quitting:
+            # Процесс остаётся запущенным со всеми фигурами до следующего показа
+            event.ignore()
+            self.hide()
+            if self.canvas.journal.is_open:
+                self.canvas.compact_journal()
+            return
+        self.client.close()
+        if self.canvas.journal.is_open:
+            self.canvas.compact_journal()
+            self.canvas.journal.close()
+        super().closeEvent(event)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Редактор масок")
+    parser.add_argument("--journal", default=edit_journal.DEFAULT_PATH,
+                        help="Файл журнала правок (отмена и восстановление после сбоя)")
+    parser.add_argument("--no-journal", action="store_true",
+                        help="Не вести журнал правок на диске")
+    parser.add_argument("--hidden", action="store_true",
+                        help="Запуститься со скрытым окном и ждать команд плеера в stdin (см. editor_process)")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="Напечатать время этапов запуска")
+    return parser.parse_known_args(argv)
+
+
+def _report_shown(report):
+    startup.mark("окно на экране")
+    if report:
+        startup.report("Редактор")
+
+
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    window = MainWindow()
-    window.show()
+    args, qt_args = parse_args()
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = MainWindow(journal_path=None if args.no_journal else args.journal)
+    window.startup_report = args.startup_report
+    startup.mark("окно построено")
+    if args.hidden:
+        window.hosted = True
+        reader = CommandReader()
+        reader.received.connect(window.handle_command)
+        reader.start()
+        if args.startup_report:
+            startup.report("Редактор (скрытый)")
+    else:
+        window.show()
+        # Срабатывает после первой отрисовки окна
+        QTimer.singleShot(0, lambda: _report_shown(args.startup_report))
     sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,199 @@
+"""
+Пространственный индекс вершин и рёбер фигур редактора.
+
+Равномерная сетка в нормализованных координатах холста (0..1): вершина
+лежит в одной ячейке, ребро - во всех ячейках своего ограничивающего
+прямоугольника. Поиск под курсором просматривает несколько ячеек вокруг
+точки, а не все точки всех фигур, и индекс не зависит от размера окна.
+"""
+from collections import defaultdict
+
+import numpy as np
+
+VERTEX = 'vertex'
+EDGE = 'edge'
+
+
+class SpatialGrid:
+    """Равномерная сетка: ячейка -> множество элементов"""
+
+    def __init__(self, cells_per_side=128):
+        self.cells_per_side = cells_per_side
+        self._cells = defaultdict(set)
+        self._items = {}  # элемент -> занятые ячейки (cx0, cy0, cx1, cy1)
+
+    def _cell(self, value):
+        return min(max(int(value * self.cells_per_side), 0), self.cells_per_side - 1)
+
+    def _range(self, x0, y0, x1, y1):
+        return (self._cell(min(x0, x1)), self._cell(min(y0, y1)),
+                self._cell(max(x0, x1)), self._cell(max(y0, y1)))
+
+    def insert(self, item, x0, y0, x1, y1):
+        """Добавляет элемент с ограничивающим прямоугольником (или заменяет его)"""
+        if item in self._items:
+            self.remove(item)
+        cx0, cy0, cx1, cy1 = cell_range = self._range(x0, y0, x1, y1)
+        self._items[item] = cell_range
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                self._cells[(cx, cy)].add(item)
+
+    def insert_many(self, items, boxes):
+        """Массовая вставка новых элементов: boxes - массив (N, 4) из x0, y0, x1, y1"""
+        boxes = np.asarray(boxes, dtype=np.float64)
+        lo = np.minimum(boxes[:, :2], boxes[:, 2:])
+        hi = np.maximum(boxes[:, :2], boxes[:, 2:])
+        last = self.cells_per_side - 1
+        ranges = np.hstack([
+            np.clip((lo * self.cells_per_side).astype(np.int64), 0, last),
+            np.clip((hi * self.cells_per_side).astype(np.int64), 0, last),
+        ]).tolist()
+        cells = self._cells
+        for item, cell_range in zip(items, ranges):
+            cx0, cy0, cx1, cy1 = cell_range
+            self._items[item] = tuple(cell_range)
+            if cx0 == cx1 and cy0 == cy1:
+                cells[(cx0, cy0)].add(item)
+                continue
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    cells[(cx, cy)].add(item)
+
+    def remove(self, item):
+        cell_range = self._items.pop(item, None)
+        if cell_range is None:
+            return
+        cx0, cy0, cx1, cy1 = cell_range
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self._cells.get((cx, cy))
+                if cell is not None:
+                    cell.discard(item)
+                    if not cell:
+                        del self._cells[(cx, cy)]
+
+    def query(self, x0, y0, x1, y1):
+        """Все элементы из ячеек, пересекающих прямоугольник"""
+        cx0, cy0, cx1, cy1 = self._range(x0, y0, x1, y1)
+        result = set()
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self._cells.get((cx, cy))
+                if cell:
+                    result |= cell
+        return result
+
+    def clear(self):
+        self._cells.clear()
+        self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ShapeIndex:
+    """
+    Индекс вершин и рёбер набора фигур.
+
+    Элементы сетки - кортежи (вид, id фигуры, номер): вершина номер i или
+    ребро от вершины i к следующей. Фигура должна иметь id, points
+    (массив N x 2 в координатах 0..1) и is_closed.
+    """
+
+    def __init__(self, cells_per_side=128):
+        self.grid = SpatialGrid(cells_per_side)
+        self.shapes = {}
+        self._sizes = {}  # id фигуры -> (число вершин, число рёбер) в индексе
+
+    def _edge_count(self, shape):
+        count = len(shape.points)
+        if count < 2:
+            return 0
+        return count if shape.is_closed else count - 1
+
+    def _insert_vertex(self, shape, i):
+        x, y = shape.points[i]
+        self.grid.insert((VERTEX, shape.id, i), x, y, x, y)
+
+    def _insert_edge(self, shape, i):
+        points = shape.points
+        x0, y0 = points[i]
+        x1, y1 = points[(i + 1) % len(points)]
+        self.grid.insert((EDGE, shape.id, i), x0, y0, x1, y1)
+
+    def add_shape(self, shape):
+        """Индексирует фигуру целиком (после вставки вершин или сдвига всей фигуры)"""
+        self.remove_shape(shape)
+        vertices, edges = len(shape.points), self._edge_count(shape)
+        self.shapes[shape.id] = shape
+        self._sizes[shape.id] = (vertices, edges)
+        if not vertices:
+            return
+        points = shape.points
+        self.grid.insert_many([(VERTEX, shape.id, i) for i in range(vertices)],
+                              np.hstack([points, points]))
+        if edges:
+            following = np.roll(points, -1, axis=0)[:edges]
+            self.grid.insert_many([(EDGE, shape.id, i) for i in range(edges)],
+                                  np.hstack([points[:edges], following]))
+
+    def remove_shape(self, shape):
+        vertices, edges = self._sizes.pop(shape.id, (0, 0))
+        self.shapes.pop(shape.id, None)
+        for i in range(vertices):
+            self.grid.remove((VERTEX, shape.id, i))
+        for i in range(edges):
+            self.grid.remove((EDGE, shape.id, i))
+
+    def update_vertex(self, shape, i):
+        """Обновляет вершину i и два прилегающих к ней ребра после её перемещения"""
+        if shape.id not in self.shapes:
+            return
+        self._insert_vertex(shape, i)
+        edges = self._sizes[shape.id][1]
+        for edge in ((i - 1) % len(shape.points), i):
+            if edge < edges:
+                self._insert_edge(shape, edge)
+
+    def clear(self):
+        self.grid.clear()
+        self.shapes.clear()
+        self._sizes.clear()
+
+    def pick(self, x, y, width, height, radius):
+        """
+        Ищет ближайшую вершину, а если её нет - ближайшее ребро под точкой.
+
+        x, y - нормализованные координаты, radius - допуск в пикселях
+        холста width x height. Возвращает (VERTEX, фигура, номер, (x, y))
+        или (EDGE, фигура, номер, проекция точки на ребро) либо None.
+        """
+        dx, dy = radius / width, radius / height
+        candidates = self.grid.query(x - dx, y - dy, x + dx, y + dy)
+        if not candidates:
+            return None
+
+        px, py = x * width, y * height
+        best_vertex, best_vertex_dist = None, radius * radius
+        best_edge, best_edge_dist = None, radius * radius
+        for kind, shape_id, i in candidates:
+            shape = self.shapes[shape_id]
+            points = shape.points
+            ax, ay = points[i]
+            ax, ay = ax * width, ay * height
+            if kind == VERTEX:
+                dist = (ax - px) ** 2 + (ay - py) ** 2
+                if dist <= best_vertex_dist:
+                    best_vertex, best_vertex_dist = (VERTEX, shape, i, tuple(points[i])), dist
+                continue
+            bx, by = points[(i + 1) % len(points)]
+            bx, by = bx * width, by * height
+            ex, ey = bx - ax, by - ay
+            length = ex * ex + ey * ey
+            t = 0.0 if length == 0 else min(max(((px - ax) * ex + (py - ay) * ey) / length, 0.0), 1.0)
+            qx, qy = ax + t * ex, ay + t * ey
+            dist = (qx - px) ** 2 + (qy - py) ** 2
+            if dist <= best_edge_dist:
+                best_edge, best_edge_dist = (EDGE, shape, i, (qx / width, qy / height)), dist
+        return best_vertex or best_edge
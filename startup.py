@@ -0,0 +1,33 @@
+"""
+Отчёт о времени запуска плеера и редактора.
+
+Модуль импортируется в main.py и shape_editor.py первым, до cv2, NumPy и
+Qt, поэтому момент его импорта - почти начало процесса (не считая запуска
+самого интерпретатора). Дальше код отмечает этапы через mark(), а
+report() печатает длительность каждого этапа и время от начала.
+"""
+import time
+
+STARTED = time.perf_counter()
+_marks = []  # [(этап, perf_counter)]
+
+
+def mark(stage):
+    """Отмечает конец этапа запуска"""
+    _marks.append((stage, time.perf_counter()))
+
+
+def elapsed():
+    """Секунды от начала процесса"""
+    return time.perf_counter() - STARTED
+
+
+def report(title):
+    """Печатает отмеченные этапы: длительность и время от начала, мс"""
+    lines = [f"{title}: время запуска"]
+    previous = STARTED
+    for stage, moment in _marks:
+        lines.append(f"  {stage:<28} {(moment - previous) * 1000:8.1f} мс"
+                     f"  (от начала {(moment - STARTED) * 1000:8.1f} мс)")
+        previous = moment
+    print('\n'.join(lines))